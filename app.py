@@ -1,97 +1,429 @@
-from flask import Flask, request, Response
-from yfinance import getQuotes
-import json
+from flask import Flask, request, Response, g, stream_with_context
+import yfinance
+from yfinance import addQuoteListener, getQuotes, getQuotesBatch
 import requests
-from datetime import datetime
+import depth
+import downstream
+import logs
+import metrics
+import portfolios
+import ratelimit
+import serialization
+import tokens
+import warmup
+from breaker import CircuitOpen
+from ratelimit import RateLimited
+from settlement import SecretFile, SettlementEngine, SettlementError
+from streaming import QuoteHub
+from valuation import ValuationEngine
+from downstream import ORDER_MGMT_URL
+from datetime import datetime, timezone
+import hmac
+import math
 import os
-from logging.config import dictConfig
-
-dictConfig({
-    'version': 1,
-    'formatters': {'default': {
-        'format': '[%(asctime)s] %(levelname)s: %(message)s',
-    }},
-    'handlers': {'wsgi': {
-        'class': 'logging.StreamHandler',
-        'stream': 'ext://flask.logging.wsgi_errors_stream',
-        'formatter': 'default'
-    }},
-    'root': {
-        'level': 'INFO',
-        'handlers': ['wsgi']
-    }
-})
+import struct
+import threading
+import time
+from yfinance.lazy import lazyImport
+
+# Only the bulk quote encodings need these
+np = lazyImport('numpy')
+msgpack = lazyImport('msgpack', optional=True)
+
+# Records are written by a background thread, see logs.py
+logs.configure()
 
 app = Flask(__name__)
+app.json = serialization.FlaskJSONProvider(app)
 
-order_secret_file = os.getenv('ORDER_SECRET_FILE')
+# Yahoo! Finance requests share the pooled downstream sessions as well
+yfinance.setClient(downstream)
+yfinance.setParseObserver(metrics.QUOTE_PARSE_LATENCY.observe)
 
-def verify(request):
+metrics.cache_stats({
+    'quotes': yfinance.getQuoteCacheStats,
+    'tokens': tokens.stats,
+    'portfolios': portfolios.stats,
+    'depth': depth.stats,
+})
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+    metrics.REQUESTS_IN_FLIGHT.inc()
+
+@app.after_request
+def record_request(response):
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    status = str(response.status_code)
+    metrics.REQUEST_LATENCY.observe(time.perf_counter() - g.request_started, route, request.method, status)
+    if response.status_code >= 500:
+        metrics.REQUEST_ERRORS.inc(route, request.method, status)
+    return response
+
+@app.teardown_request
+def finish_request(exception):
+    if 'request_started' in g:
+        metrics.REQUESTS_IN_FLIGHT.dec()
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), status=200, content_type=metrics.CONTENT_TYPE)
+
+# Read once and re-read only when the file changes
+order_secret_file = SecretFile(os.getenv('ORDER_SECRET_FILE'))
+
+settlement_engine = SettlementEngine()
+
+# Every quote fetched, on request or by the refresher, updates the valuations
+valuation_engine = ValuationEngine()
+addQuoteListener(lambda symbol, quote: valuation_engine.update_price(symbol, quote.get('price')))
+
+# Streaming subscriptions: keep-alive comment interval and symbols per client
+STREAM_HEARTBEAT = float(os.getenv('STREAM_HEARTBEAT', '15'))
+STREAM_MAX_SYMBOLS = int(os.getenv('STREAM_MAX_SYMBOLS', '50'))
+# Each subscriber holds a server thread for as long as it stays connected, so
+# only this many per worker are accepted here; asgi.py serves the stream on
+# its event loop for larger numbers of subscribers
+STREAM_MAX_SUBSCRIBERS = int(os.getenv('STREAM_MAX_SUBSCRIBERS', '4'))
+
+# Serve the last known quote when Yahoo!'s circuit breaker is open
+QUOTE_STALE_FALLBACK = os.getenv('QUOTE_STALE_FALLBACK', 'true').lower() == 'true'
+
+# Most symbols a single GET /quotes may ask for
+QUOTES_BULK_MAX = int(os.getenv('QUOTES_BULK_MAX', '200'))
+
+# Largest basket accepted by /orders/batch
+ORDER_BATCH_MAX = int(os.getenv('ORDER_BATCH_MAX', '500'))
+
+# Request budgets per client: authenticated routes are keyed by clientID,
+# the anonymous quote routes by client address. Behind a load balancer that
+# is only meaningful with RATE_LIMIT_TRUSTED_PROXIES set, so quotes are
+# unlimited unless RATE_LIMIT_QUOTES is given.
+rate_limits = {
+    'quotes': ratelimit.from_env('quotes', rate=0, burst=40),
+    'orders': ratelimit.from_env('orders', rate=5, burst=10),
+    'portfolio': ratelimit.from_env('portfolio', rate=5, burst=10),
+}
+ROUTE_BUDGETS = {
+    'get_quotes': 'quotes',
+    'get_quotes_bulk': 'quotes',
+    'get_history': 'quotes',
+    'stream_quotes': 'quotes',
+    'place_buy_order': 'orders',
+    'place_sell_order': 'orders',
+    'get_orders': 'orders',
+    'place_batch_order': 'orders',
+    'update_order': 'orders',
+    'remove_order': 'orders',
+    'get_portfolio': 'portfolio',
+    'deposit': 'portfolio',
+    'withdraw': 'portfolio',
+}
+ANONYMOUS_ROUTES = {'get_quotes', 'get_quotes_bulk', 'get_history', 'stream_quotes'}
+
+metrics.Callback('platform_rate_limited_total', 'Requests refused for exceeding a rate limit.', 'counter', ('budget',),
+                 lambda: [((name,), limiter.stats()['limited']) for name, limiter in rate_limits.items()])
+
+def check_rate(endpoint, key, cost=1):
+    # Raises RateLimited if key has used up its budget for endpoint
+    budget = ROUTE_BUDGETS.get(endpoint)
+    if budget is None:
+        return
+    retry_after = rate_limits[budget].acquire(key, cost)
+    if retry_after:
+        raise RateLimited(budget, key, retry_after)
+
+@app.before_request
+def limit_anonymous():
+    if request.endpoint in ANONYMOUS_ROUTES:
+        check_rate(request.endpoint, ratelimit.client_address(request.remote_addr, request.headers.get('X-Forwarded-For')))
+
+@app.errorhandler(RateLimited)
+@app.errorhandler(downstream.Saturated)
+def too_many_requests(e):
+    app.logger.warning("Request refused: %s", e)
+    return Response(status=429, headers={'Retry-After': str(math.ceil(e.retry_after) or 1)})
+
+def json_response(content, status=200, headers=None):
+    return Response(serialization.dumps(content), status=status, mimetype="application/json", headers=headers)
+
+def proxy(response):
+    # Hand a downstream response on as is, without decoding and re-encoding it
+    return Response(response.content, status=response.status_code,
+                    content_type=response.headers.get('Content-Type', 'application/json'))
+
+def secret_matches(given, secret):
+    # In constant time; compare_digest only takes ASCII str, so compare bytes
+    return hmac.compare_digest(str(given).encode('utf-8'), secret.encode('utf-8'))
+
+def verify(request, charge=True):
+    # charge=False leaves the rate limit check to the caller
     authHeader = request.headers.get('authorization')
     
     if authHeader is None:
         app.logger.error("No token provided.")
         return None
     
-    headers = {'Authorization' : authHeader}
-    response = requests.post("http://auth:5000/verify", headers=headers)
-    app.logger.debug("Response received from Auth Service.")
-
-    if response.status_code == 200:
-        app.logger.info(f"Token is valid.")  
-        return response.json()
+    # Verifications are cached, so only unseen or expired tokens reach the Auth Service
+    result = tokens.verify_token(authHeader)
+    app.logger.debug("Token verification result received.")
+
+    if result is not None:
+        app.logger.info("Token is valid.", extra=logs.SAMPLED)  
+        if charge:
+            check_rate(request.endpoint, result['clientID'])
+        return result
     else:
-        app.logger.error(f"Token is invalid.")  
+        app.logger.error("Token is invalid.")  
         return None
+
+@app.route('/breakers', methods=['GET'])
+def get_breakers():
+    # Circuit breaker state of every downstream service called so far
+    return json_response(downstream.breakers())
+
+@app.route('/ready', methods=['GET'])
+def get_ready():
+    # 503 until the worker has warmed up, and while a service it couldn't
+    # reach stays unreachable, see warmup.py
+    # ready() first, it may update the status
+    ready = warmup.ready()
+    return json_response(warmup.status(), status=200 if ready else 503)
+
+@app.route('/verify/invalidate', methods=['POST'])
+def invalidate_token():
+    # Drop the cached verification of the presented token (e.g. on logout)
+    authHeader = request.headers.get('authorization')
+    if authHeader is None:
+        app.logger.error("No token provided.")
+        return Response(status=400)
+
+    tokens.invalidate(authHeader)
+    app.logger.info("Cached token verification invalidated.")
+    return Response(status=204)
         
+@app.errorhandler(CircuitOpen)
+def downstream_circuit_open(e):
+    # Fail fast while the service recovers; tell clients when to come back
+    app.logger.error("Downstream request refused: %s", e)
+    return Response(status=503, headers={'Retry-After': str(math.ceil(e.retry_after) or 1)})
+
+@app.errorhandler(requests.exceptions.Timeout)
+def downstream_timeout(e):
+    app.logger.error("Downstream request timed out: %s", e)
+    return Response(status=504)
+
+@app.errorhandler(requests.exceptions.RequestException)
+def downstream_unavailable(e):
+    app.logger.error("Downstream request failed: %s", e)
+    return Response(status=503)
+
 @app.route('/quotes/<symbol>', methods=['GET'])
 def get_quotes(symbol):
-    quotes = getQuotes(symbol)
-    app.logger.debug(f"Got quotes for symbol {symbol}.")
+    try:
+        quotes = getQuotes(symbol)
+    except CircuitOpen:
+        # Yahoo! is failing: fall back to the last quote we had, without depth
+        quotes = yfinance.staleQuote(symbol) if QUOTE_STALE_FALLBACK else None
+        if quotes is None:
+            raise
+        app.logger.warning("Returning stale quote for %s", symbol)
+        return json_response(quotes, 200, headers={'Warning': '110 - "Response is Stale"'})
+    app.logger.debug("Got quotes for symbol %s.", symbol)
 
     if quotes is None:
-        app.logger.error(f"The symbol {symbol} could not be found") 
+        app.logger.error("The symbol %s could not be found", symbol) 
         return Response(status=404)
 
-    response = requests.get(f"http://order-mgmt:5000/depth/{symbol}")
-    app.logger.debug(f"Response  with depth for {symbol} received from Order Management Service.")
+    # Clients only interested in the price can skip the order book
+    if request.args.get('depth', 'true').lower() in ('false', '0', 'no'):
+        app.logger.info("Returning quote for %s without depth information", symbol, extra=logs.SAMPLED)
+        return json_response(quotes)
+
+    try:
+        book = depth.fetch(symbol)
+    except CircuitOpen:
+        # Order Management is failing; the quote is still worth returning
+        book = None
+    app.logger.debug("Response  with depth for %s received from Order Management Service.", symbol)
+
+    if book is not None:
+        app.logger.info("Returning quote for %s with depth information", symbol, extra=logs.SAMPLED)
+        quotes['depth']  = book
+    else:
+        app.logger.info("Returning quote for %s without depth information", symbol, extra=logs.SAMPLED)
+
+    return json_response(quotes)
+
+# Numeric quote fields, in the order of the packed encoding's columns
+PACKED_FIELDS = ('price', 'change', 'changePercent', 'volume', 'bid', 'ask')
+
+def encode_packed(symbols, quotes):
+    # Little-endian uint32 symbol count, then one float64 column per field
+    # in PACKED_FIELDS, NaN where a symbol or field is missing
+    columns = np.full((len(PACKED_FIELDS), len(symbols)), np.nan, dtype='<f8')
+    for column, symbol in enumerate(symbols):
+        quote = quotes.get(symbol) or {}
+        for row, field in enumerate(PACKED_FIELDS):
+            if quote.get(field) is not None:
+                columns[row, column] = quote[field]
+    return struct.pack('<I', len(symbols)) + columns.tobytes()
+
+def bulk_fallback(symbol, e):
+    # One failing symbol shouldn't fail the others: use its last known quote
+    if not isinstance(e, requests.exceptions.RequestException):
+        raise e
+    app.logger.warning("Quote for %s could not be fetched: %s", symbol, e)
+    return yfinance.staleQuote(symbol) if QUOTE_STALE_FALLBACK else None
+
+@app.route('/quotes', methods=['GET'])
+def get_quotes_bulk():
+    # Quotes for ?symbols=A,B,... in one response, null for unknown symbols.
+    # ?format= (or Accept) picks json, msgpack or packed.
+    symbols = list(dict.fromkeys(symbol.strip() for symbol in request.args.get('symbols', '').split(',') if symbol.strip()))
+    if not symbols or len(symbols) > QUOTES_BULK_MAX:
+        app.logger.error("Bulk quote request for %s symbols refused.", len(symbols))
+        return Response(status=400)
 
-    if response.status_code == 200:
-        app.logger.info(f"Returning quote for {symbol} with depth information")
-        quotes['depth']  = response.json()
+    accept = request.headers.get('Accept', '')
+    format = request.args.get('format') or ('msgpack' if 'msgpack' in accept else 'packed' if 'application/octet-stream' in accept else 'json')
+    if format not in ('json', 'msgpack', 'packed') or (format == 'msgpack' and msgpack is None):
+        app.logger.error("Unsupported bulk quote format %s.", format)
+        return Response(status=406)
+
+    quotes = getQuotesBatch(symbols, fallback=bulk_fallback)
+    app.logger.info("Returning %s quotes as %s", len(symbols), format, extra=logs.SAMPLED)
+    if format == 'msgpack':
+        return Response(msgpack.packb(quotes), status=200, mimetype="application/msgpack")
+    if format == 'packed':
+        return Response(encode_packed(symbols, quotes), status=200, mimetype="application/octet-stream",
+                        headers={'X-Quote-Symbols': ','.join(symbols), 'X-Quote-Fields': ','.join(PACKED_FIELDS)})
+    return json_response(quotes)
+
+def parse_time(value):
+    # Epoch seconds or an ISO 8601 date/time (UTC unless it says otherwise)
+    try:
+        return int(value)
+    except ValueError:
+        moment = datetime.fromisoformat(value)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return int(moment.timestamp())
+
+@app.route('/quotes/<symbol>/history', methods=['GET'])
+def get_history(symbol):
+    # OHLCV bars as columns: {"time": [...], "open": [...], ...}
+    interval = request.args.get('interval', '1d')
+    try:
+        start = parse_time(request.args['start'])
+        end = parse_time(request.args['end']) if 'end' in request.args else None
+        bars = yfinance.getHistory(symbol, start, end, interval)
+    except (KeyError, ValueError) as e:
+        app.logger.error("Invalid history request for %s: %s", symbol, e)
+        return Response(status=400)
+    app.logger.debug("Returning %s %s bars for %s", len(bars['time']), interval, symbol)
+
+    body = {'symbol': symbol, 'interval': interval}
+    body.update((name, column.tolist()) for name, column in bars.items())
+    return json_response(body)
+
+@app.route('/depth/<symbol>/invalidate', methods=['POST'])
+def invalidate_depth(symbol):
+    # Called by Order Management when the book for symbol changes. The new
+    # book may be pushed along as 'depth'; otherwise it is fetched on next use.
+    payload = request.get_json(force=True)
+    order_secret = order_secret_file.read()
+    if order_secret == None:
+        app.logger.error("Order Managament Secret not known by Platform.")
+        return Response(status=400)
+    if not secret_matches(payload.get('secret'), order_secret):
+        app.logger.error("Depth invalidation not issued by Order Management Service.")
+        return Response(status=401)
+
+    if 'depth' in payload:
+        depth.store(symbol, payload['depth'], everywhere=True)
     else:
-        app.logger.info(f"Returning quote for {symbol} without depth information")
+        depth.invalidate(symbol)
+    app.logger.debug("Depth for %s invalidated.", symbol)
+    return Response(status=204)
 
-    return Response(json.dumps(quotes), status=200, mimetype="application/json")
+def quote_snapshot(symbol):
+    # Quote and order book depth for symbol, as pushed to stream subscribers
+    quotes = getQuotes(symbol)
+    if quotes is None:
+        return None
+    book = depth.fetch(symbol)
+    if book is not None:
+        quotes['depth'] = book
+    return quotes
+
+quote_hub = QuoteHub(quote_snapshot)
+stream_slots = threading.BoundedSemaphore(STREAM_MAX_SUBSCRIBERS)
+
+@app.route('/quotes/stream', methods=['GET'])
+def stream_quotes():
+    symbols = [symbol.strip() for symbol in request.args.get('symbols', '').split(',') if symbol.strip()]
+    symbols = list(dict.fromkeys(symbols))
+    if not symbols or len(symbols) > STREAM_MAX_SYMBOLS:
+        app.logger.error("Invalid stream subscription for symbols %s", symbols)
+        return json_response({'error': f'provide between 1 and {STREAM_MAX_SYMBOLS} symbols'}, 400)
+
+    if not stream_slots.acquire(blocking=False):
+        app.logger.warning("Quote stream refused, %s subscribers already connected.", STREAM_MAX_SUBSCRIBERS)
+        return Response(status=503, headers={'Retry-After': str(math.ceil(STREAM_HEARTBEAT))})
+    subscription = quote_hub.subscribe(symbols)
+    app.logger.info("Client subscribed to quote stream for %s", ','.join(symbols))
+
+    def events():
+        yield "retry: 3000\n\n"
+        while True:
+            updates = subscription.next(timeout=STREAM_HEARTBEAT)
+            if not updates:
+                # Keeps proxies from closing the connection and detects gone clients
+                yield ": keep-alive\n\n"
+            for symbol, snapshot in updates:
+                yield f"event: quote\ndata: {serialization.dumps(dict(snapshot, symbol=symbol)).decode()}\n\n"
+
+    def close():
+        # Runs when the server closes the response, even if it never started
+        quote_hub.unsubscribe(subscription)
+        stream_slots.release()
+        app.logger.info("Client unsubscribed from quote stream for %s", ','.join(symbols))
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    response = Response(stream_with_context(events()), status=200, mimetype='text/event-stream', headers=headers)
+    response.call_on_close(close)
+    return response
 
 @app.route('/quotes/<symbol>/buy', methods=['POST'])
 def place_buy_order(symbol):
     # Verify if the client is authenticated
     res = verify(request)
-    app.logger.debug(f"Request token was verified.")
+    app.logger.debug("Request token was verified.")
     if res is None:
         app.logger.error("Client provided invalid token for authentication.")
         return Response(status=401)
     
     clientID = res['clientID']
-    app.logger.debug(f"Client ID is {clientID}")
+    app.logger.debug("Client ID is %s", clientID)
 
     payload = request.get_json(force=True)
     quantity = int(payload['quantity'])
     price = float(payload['price'])
-    app.logger.debug(f"Client {clientID} placed order with: qty={quantity}, price={price}.")
+    app.logger.debug("Client %s placed order with: qty=%s, price=%s.", clientID, quantity, price)
     # Request client's portfolio from Portfolio Management Service
-    response = requests.get(f"http://portfolio-mgmt:5000/portfolio/{clientID}")
-    app.logger.debug(f"Got response from Portfolio Management Service")
-    if not response is None:
-        app.logger.info(f"Received portfolio for client {clientID}")
-        portfolio = response.json()
+    # Always checked against the latest portfolio, never the cached one
+    portfolio, status = portfolios.fetch(clientID, fresh=True)
+    app.logger.debug("Got response from Portfolio Management Service")
+    if portfolio is not None:
+        app.logger.info("Received portfolio for client %s", clientID, extra=logs.SAMPLED)
         if float(portfolio['Cash']) < price * quantity:
-            app.logger.error(f"Client {clientID} has insufficient funds to place buy order.")
-            return Response(json.dumps({'error': 'insufficient funds'}), status=400, mimetype='application/json')
+            app.logger.error("Client %s has insufficient funds to place buy order.", clientID)
+            return json_response({'error': 'insufficient funds'}, 400)
     else:
-        app.logger.error(f"Portfolio for client {clientID} not found")
-        return Response(json.dumps({'error': 'portfolio not found'}), status=400, mimetype='application/json')
+        app.logger.error("Portfolio for client %s not found", clientID)
+        return json_response({'error': 'portfolio not found'}, 400)
     
     order_payload = {
         "client_id": clientID,
@@ -101,51 +433,51 @@ def place_buy_order(symbol):
         "price": price,
         "placed_at": datetime.now().isoformat()
     }
-    app.logger.info(f"{clientID}: BUY {quantity} {symbol} @ {price}")
-    app.logger.debug(f"Sending BUY order from {clientID} to Order Management")
-    response = requests.post("http://order-mgmt:5000/orders", json=order_payload)
-    app.logger.debug(f"Received response from Order Management for {clientID}'s BUY order.")
+    app.logger.info("%s: BUY %s %s @ %s", clientID, quantity, symbol, price)
+    app.logger.debug("Sending BUY order from %s to Order Management", clientID)
+    response = downstream.post(f"{ORDER_MGMT_URL}/orders", json=order_payload)
+    app.logger.debug("Received response from Order Management for %s's BUY order.", clientID)
 
     if response.status_code == 200:
-        app.logger.info(f"Buy Order of {clientID} executed directly.")
+        app.logger.info("Buy Order of %s executed directly.", clientID)
     elif response.status_code == 201:
-        app.logger.info(f"Buy Order of {clientID} was placed, but not executed yet.")
+        app.logger.info("Buy Order of %s was placed, but not executed yet.", clientID)
     else:
-        app.logger.error(f"Buy Order of {clientID} could not be placed.")
+        app.logger.error("Buy Order of %s could not be placed.", clientID)
 
-    return Response(json.dumps(response.json()), status=response.status_code, mimetype='application/json')
+    return proxy(response)
 
 @app.route('/quotes/<symbol>/sell', methods=['POST'])
 def place_sell_order(symbol):
     # Verify if the client is authenticated
     res = verify(request)
-    app.logger.debug(f"Request token was verified.")
+    app.logger.debug("Request token was verified.")
     if res is None:
         app.logger.error("Client provided invalid token for authentication.")
         return Response(status=401)
     
     clientID = res['clientID']
-    app.logger.debug(f"Client ID is {clientID}")
+    app.logger.debug("Client ID is %s", clientID)
 
     payload = request.get_json(force=True)
     quantity = int(payload['quantity'])
     price = float(payload['price'])
-    app.logger.debug(f"Client{clientID} placed order with: qty={quantity}, price={price}.")
+    app.logger.debug("Client%s placed order with: qty=%s, price=%s.", clientID, quantity, price)
     # Request client's portfolio from Portfolio Management Service
-    response = requests.get(f"http://portfolio-mgmt:5000/portfolio/{clientID}")
-    app.logger.debug(f"Got response from Portfolio Management Service")
-    if not response is None:
-        app.logger.info(f"Received portfolio for client {clientID}")
-        portfolio = response.json()
+    # Always checked against the latest portfolio, never the cached one
+    portfolio, status = portfolios.fetch(clientID, fresh=True)
+    app.logger.debug("Got response from Portfolio Management Service")
+    if portfolio is not None:
+        app.logger.info("Received portfolio for client %s", clientID, extra=logs.SAMPLED)
         if portfolio.get(symbol) is None:
-            app.logger.error(f"Client {clientID} does not have symbol {symbol} in their portfolio.")
-            return Response(json.dumps({'error': 'symbol not found in portfolio'}), status=400, mimetype='application/json')
+            app.logger.error("Client %s does not have symbol %s in their portfolio.", clientID, symbol)
+            return json_response({'error': 'symbol not found in portfolio'}, 400)
         elif float(portfolio[symbol]) < quantity:
-            app.logger.error(f"Client {clientID} does not have enough qunatity of {symbol} in their portfolio. ({portfolio['symbol']} vs. {quantity})")
-            return Response(json.dumps({'error': 'quantity of order exceeds available amount'}), status=400, mimetype='application/json')
+            app.logger.error("Client %s does not have enough qunatity of %s in their portfolio. (%s vs. %s)", clientID, symbol, portfolio[symbol], quantity)
+            return json_response({'error': 'quantity of order exceeds available amount'}, 400)
     else:
-        app.logger.error(f"Portfolio for client {clientID} not found")
-        return Response(json.dumps({'error': 'portfolio not found'}), status=400, mimetype='application/json')
+        app.logger.error("Portfolio for client %s not found", clientID)
+        return json_response({'error': 'portfolio not found'}, 400)
     
     order_payload = {
         "client_id": clientID,
@@ -155,342 +487,350 @@ def place_sell_order(symbol):
         "price": price,
         "placed_at": datetime.now().isoformat()
     }
-    app.logger.info(f"{clientID}: SELL {quantity} {symbol} @ {price}")
-    app.logger.debug(f"Sending SELL order from {clientID} to Order Management")
-    response = requests.post("http://order-mgmt:5000/orders", json=order_payload)
-    app.logger.debug(f"Received response from Order Management for {clientID}'s SELL order.")
+    app.logger.info("%s: SELL %s %s @ %s", clientID, quantity, symbol, price)
+    app.logger.debug("Sending SELL order from %s to Order Management", clientID)
+    response = downstream.post(f"{ORDER_MGMT_URL}/orders", json=order_payload)
+    app.logger.debug("Received response from Order Management for %s's SELL order.", clientID)
 
     if response.status_code == 200:
-        app.logger.info(f"Sell Order of {clientID} executed directly.")
+        app.logger.info("Sell Order of %s executed directly.", clientID)
     elif response.status_code == 201:
-        app.logger.info(f"Sell Order of {clientID} was placed, but not executed yet.")
+        app.logger.info("Sell Order of %s was placed, but not executed yet.", clientID)
     else:
-        app.logger.error(f"Sell Order of {clientID} could not be placed.")
+        app.logger.error("Sell Order of %s could not be placed.", clientID)
 
-    return Response(json.dumps(response.json()), status=response.status_code, mimetype='application/json')
+    return proxy(response)
 
 
 @app.route('/orders', methods=['GET'])
 def get_orders():
     # Verify if the client is authenticated
     res = verify(request)
-    app.logger.debug(f"Request token was verified.")
+    app.logger.debug("Request token was verified.")
     if res is None:
         app.logger.error("Client provided invalid token for authentication.")
         return Response(status=401)
     
     clientID = res['clientID']
-    app.logger.debug(f"Client ID is {clientID}")
+    app.logger.debug("Client ID is %s", clientID)
 
-    response = requests.get(f"http://order-mgmt:5000/orders/client/{clientID}")
-    app.logger.debug(f"Received response for GET {clientID} orders")
+    response = downstream.get(f"{ORDER_MGMT_URL}/orders/client/{clientID}")
+    app.logger.debug("Received response for GET %s orders", clientID)
 
     if response.status_code == 200:
-        app.logger.info(f"Orders of {clientID} received.")
+        app.logger.info("Orders of %s received.", clientID, extra=logs.SAMPLED)
     else:
-        app.logger.error(f"Orders of {clientID} were not received.")
-    return Response(json.dumps(response.json()), status=response.status_code, mimetype='application/json')
+        app.logger.error("Orders of %s were not received.", clientID)
+    return proxy(response)
+
+def parse_batch_order(order):
+    symbol = str(order['symbol'])
+    type = order['type']
+    if type not in ('B', 'S'):
+        raise ValueError(f"unknown order type {type}")
+    quantity = int(order['quantity'])
+    price = float(order['price'])
+    if quantity <= 0 or price <= 0:
+        raise ValueError("quantity and price must be positive")
+    return symbol, type, quantity, price
+
+def submit_order(order_payload):
+    try:
+        response = downstream.post(f"{ORDER_MGMT_URL}/orders", json=order_payload)
+    except requests.exceptions.RequestException as e:
+        return {'status': 503, 'error': str(e)}
+    try:
+        body = serialization.body(response)
+    except ValueError:
+        body = None
+    return {'status': response.status_code, 'order': body}
+
+@app.route('/orders/batch', methods=['POST'])
+def place_batch_order():
+    # Verify if the client is authenticated
+    res = verify(request, charge=False)
+    app.logger.debug("Request token was verified.")
+    if res is None:
+        app.logger.error("Client provided invalid token for authentication.")
+        return Response(status=401)
+
+    clientID = res['clientID']
+    app.logger.debug("Client ID is %s", clientID)
+
+    payload = request.get_json(force=True)
+    orders = payload.get('orders') if isinstance(payload, dict) else payload
+    if not isinstance(orders, list) or not orders or len(orders) > ORDER_BATCH_MAX:
+        app.logger.error("Client %s sent an invalid order batch.", clientID)
+        return json_response({'error': f'provide a list of 1 to {ORDER_BATCH_MAX} orders'}, 400)
+    # Every order in the basket counts against the client's budget
+    check_rate(request.endpoint, clientID, cost=len(orders))
+
+    parsed = []
+    for index, order in enumerate(orders):
+        try:
+            parsed.append(parse_batch_order(order))
+        except (KeyError, TypeError, ValueError) as e:
+            app.logger.error("Client %s sent an invalid order at index %s: %s", clientID, index, e)
+            return json_response({'error': f'invalid order: {e}', 'index': index}, 400)
+
+    # One portfolio check covering what the whole basket needs
+    required_cash = sum(price * quantity for _, type, quantity, price in parsed if type == 'B')
+    required_quantities = {}
+    for symbol, type, quantity, _ in parsed:
+        if type == 'S':
+            required_quantities[symbol] = required_quantities.get(symbol, 0) + quantity
+
+    portfolio, status = portfolios.fetch(clientID, fresh=True)
+    app.logger.debug("Got response from Portfolio Management Service")
+    if portfolio is None:
+        app.logger.error("Portfolio for client %s not found", clientID)
+        return json_response({'error': 'portfolio not found'}, 400)
+
+    if float(portfolio['Cash']) < required_cash:
+        app.logger.error("Client %s has insufficient funds to place the order batch.", clientID)
+        return json_response({'error': 'insufficient funds'}, 400)
+    for symbol, quantity in required_quantities.items():
+        if portfolio.get(symbol) is None:
+            app.logger.error("Client %s does not have symbol %s in their portfolio.", clientID, symbol)
+            return json_response({'error': 'symbol not found in portfolio', 'symbol': symbol}, 400)
+        elif float(portfolio[symbol]) < quantity:
+            app.logger.error("Client %s does not have enough quantity of %s in their portfolio. (%s vs. %s)", clientID, symbol, portfolio[symbol], quantity)
+            return json_response({'error': 'quantity of order exceeds available amount', 'symbol': symbol}, 400)
+
+    placed_at = datetime.now().isoformat()
+    order_payloads = [{
+        "client_id": clientID,
+        "symbol": symbol,
+        "type": type,
+        "quantity": quantity,
+        "price": price,
+        "placed_at": placed_at
+    } for symbol, type, quantity, price in parsed]
+
+    app.logger.info("%s: BATCH of %s orders", clientID, len(order_payloads))
+    results = list(downstream.executor().map(submit_order, order_payloads))
+    for index, result in enumerate(results):
+        result['index'] = index
+        if result['status'] not in (200, 201):
+            app.logger.error("Order %s of %s's batch could not be placed.", index, clientID)
+
+    return json_response({'results': results})
 
 @app.route('/orders/<id>', methods=['PUT'])
 def update_order(id):
     # Verify if the client is authenticated
     res = verify(request)
-    app.logger.debug(f"Request token was verified.")
+    app.logger.debug("Request token was verified.")
     if res is None:
         app.logger.error("Client provided invalid token for authentication.")
         return Response(status=401)
     
     clientID = res['clientID']
-    app.logger.debug(f"Client ID is {clientID}")
+    app.logger.debug("Client ID is %s", clientID)
 
-    get_response = requests.get(f"http://order-mgmt:5000/orders/{id}")
-    app.logger.debug(f"Got response for GET ORDER BY ID (id={id})")
+    get_response = downstream.get(f"{ORDER_MGMT_URL}/orders/{id}")
+    app.logger.debug("Got response for GET ORDER BY ID (id=%s)", id)
 
     if get_response.status_code == 404:
-        app.logger.error(f"Order with id={id} not found.")
+        app.logger.error("Order with id=%s not found.", id)
         return Response(status=get_response.status_code)
     elif get_response.status_code == 400:
-        app.logger.error(f"Order with id={id} could not be fetched succesfully.")
+        app.logger.error("Order with id=%s could not be fetched succesfully.", id)
         return Response(status=get_response.status_code)
     
-    app.logger.info(f"Order with id={id} found.")
-    order_json = get_response.json()
+    app.logger.info("Order with id=%s found.", id)
+    order_json = serialization.body(get_response)
     if order_json['ClientID'] != clientID:
-        app.logger.error(f"Order with id={id} was not placed by {clientID}.")
+        app.logger.error("Order with id=%s was not placed by %s.", id, clientID)
         return Response(status=401)
     
     payload = request.get_json(force=True)
     quantity = int(payload['quantity'])
     price = float(payload['price'])
-    app.logger.debug(f"Client {clientID} updated order id={id} with: qty={quantity}, price={price}.")
+    app.logger.debug("Client %s updated order id=%s with: qty=%s, price=%s.", clientID, id, quantity, price)
     if order_json['Type'] == 'B':
         # Request client's portfolio from Portfolio Management Service
-        response = requests.get(f"http://portfolio-mgmt:5000/portfolio/{clientID}")
-        app.logger.debug(f"Got response from Portfolio Management Service")
-        if not response is None:
-            app.logger.info(f"Received portfolio for client {clientID}")
-            portfolio = response.json()
+        # Always checked against the latest portfolio, never the cached one
+        portfolio, status = portfolios.fetch(clientID, fresh=True)
+        app.logger.debug("Got response from Portfolio Management Service")
+        if portfolio is not None:
+            app.logger.info("Received portfolio for client %s", clientID, extra=logs.SAMPLED)
             if float(portfolio['Cash']) < price * quantity:
-                app.logger.error(f"Client {clientID} has insufficient funds to place buy order.")
-                return Response(json.dumps({'error': 'insufficient funds'}), status=400, mimetype='application/json')
+                app.logger.error("Client %s has insufficient funds to place buy order.", clientID)
+                return json_response({'error': 'insufficient funds'}, 400)
         else:
-            app.logger.error(f"Portfolio for client {clientID} not found")
-            return Response(json.dumps({'error': 'portfolio not found'}), status=400, mimetype='application/json')
+            app.logger.error("Portfolio for client %s not found", clientID)
+            return json_response({'error': 'portfolio not found'}, 400)
     else:
         # Request client's portfolio from Portfolio Management Service
-        response = requests.get(f"http://portfolio-mgmt:5000/portfolio/{clientID}")
+        # Always checked against the latest portfolio, never the cached one
+        portfolio, status = portfolios.fetch(clientID, fresh=True)
         app.logger.debug("Got response from Portfolio Management Service")
-        if not response is None:
-            portfolio = response.json()
+        if portfolio is not None:
             symbol = order_json.get("Symbol")
 
             if portfolio.get(symbol) is None:
-                app.logger.error(f"Client {clientID} does not have symbol {symbol} in their portfolio.")
-                return Response(json.dumps({'error': 'symbol not found in portfolio'}), status=400, mimetype='application/json')
+                app.logger.error("Client %s does not have symbol %s in their portfolio.", clientID, symbol)
+                return json_response({'error': 'symbol not found in portfolio'}, 400)
             elif float(portfolio[symbol]) < quantity:
-                app.logger.error(f"Client {clientID} does not have enough qunatity of {symbol} in their portfolio. ({portfolio['symbol']} vs. {quantity})")
-                return Response(json.dumps({'error': 'quantity of order exceeds available amount'}), status=400, mimetype='application/json')
+                app.logger.error("Client %s does not have enough qunatity of %s in their portfolio. (%s vs. %s)", clientID, symbol, portfolio[symbol], quantity)
+                return json_response({'error': 'quantity of order exceeds available amount'}, 400)
         else:
-            app.logger.error(f"Portfolio for client {clientID} not found")
-            return Response(json.dumps({'error': 'portfolio not found'}), status=400, mimetype='application/json')
+            app.logger.error("Portfolio for client %s not found", clientID)
+            return json_response({'error': 'portfolio not found'}, 400)
         
     update_payload = {
         "quantity": quantity,
         "price": price,
         "placed_at": datetime.now().isoformat()
     }
-    app.logger.info(f"{clientID}: UPDATE ORDER {id}: qty={quantity}, price={price}")
-    app.logger.debug(f"Sending updated order from {clientID} to Order Management")
-    response=requests.put(f"http://order-mgmt:5000/orders/{id}", json=update_payload)
-    app.logger.debug(f"Received response from Order Management for {clientID}'s SELL order.")
+    app.logger.info("%s: UPDATE ORDER %s: qty=%s, price=%s", clientID, id, quantity, price)
+    app.logger.debug("Sending updated order from %s to Order Management", clientID)
+    response=downstream.put(f"{ORDER_MGMT_URL}/orders/{id}", json=update_payload)
+    app.logger.debug("Received response from Order Management for %s's SELL order.", clientID)
 
     if response.status_code == 200:
-        app.logger.info(f"Order {id} of {clientID} updated.")
+        app.logger.info("Order %s of %s updated.", id, clientID)
     elif response.status_cod == 404:
-        app.logger.error(f"Order {id} does not exist.")
+        app.logger.error("Order %s does not exist.", id)
     else:
-        app.logger.error(f"Order {id} of {clientID} could not be updated.")
+        app.logger.error("Order %s of %s could not be updated.", id, clientID)
 
-    return Response(json.dumps(response.json()), status=response.status_code, mimetype='application/json')
+    return proxy(response)
 
 @app.route('/orders/<id>', methods=['DELETE'])
 def remove_order(id):
     # Verify if the client is authenticated
     res = verify(request)
-    app.logger.debug(f"Request token was verified.")
+    app.logger.debug("Request token was verified.")
     if res is None:
         app.logger.error("Client provided invalid token for authentication.")
         return Response(status=401)
     
     clientID = res['clientID']
-    app.logger.debug(f"Client ID is {clientID}")
+    app.logger.debug("Client ID is %s", clientID)
 
-    get_response = requests.get(f"http://order-mgmt:5000/orders/{id}")
-    app.logger.debug(f"Got response for GET ORDER BY ID (id={id})")
+    get_response = downstream.get(f"{ORDER_MGMT_URL}/orders/{id}")
+    app.logger.debug("Got response for GET ORDER BY ID (id=%s)", id)
 
     if get_response.status_code == 404:
-        app.logger.error(f"Order with id={id} not found.")
-        return Response(json.dumps({'error': 'order not found'}), status=404, mimetype='application/json')
+        app.logger.error("Order with id=%s not found.", id)
+        return json_response({'error': 'order not found'}, 404)
     elif get_response.status_code != 200:
-        app.logger.error(f"Order with id={id} could not be fetched succesfully.")
+        app.logger.error("Order with id=%s could not be fetched succesfully.", id)
         return Response(status=get_response.status_code)
     
-    app.logger.info(f"Order with id={id} found.")
-    order_json = get_response.json()
+    app.logger.info("Order with id=%s found.", id)
+    order_json = serialization.body(get_response)
     if order_json['ClientID'] != clientID:
-        app.logger.error(f"Order with id={id} was not placed by {clientID}.")
+        app.logger.error("Order with id=%s was not placed by %s.", id, clientID)
         return Response(status=401)
     
-    response = requests.delete(f"http://order-mgmt:5000/orders/{id}")
-    app.logger.debug(f"Got response for DELETE ORDER {id} from Order Management Service")
+    response = downstream.delete(f"{ORDER_MGMT_URL}/orders/{id}")
+    app.logger.debug("Got response for DELETE ORDER %s from Order Management Service", id)
 
     if response.status_code == 200:
-        app.logger.info(f"Order with id={id} deleted succesfully.")
-        return Response(json.dumps({'id': id}), status=200, mimetype='application/json')
+        app.logger.info("Order with id=%s deleted succesfully.", id)
+        return json_response({'id': id})
     
-    app.logger.error(f"Order with id={id} could not be deleted.")
+    app.logger.error("Order with id=%s could not be deleted.", id)
     return Response(status=400)
 
 @app.route('/orders/process', methods=['POST'])
 def process_order():
     payload = request.get_json(force=True)
-    order_secret = None
-    with open(order_secret_file) as file:
-        order_secret = file.read()
+    order_secret = order_secret_file.read()
     if order_secret == None:
         app.logger.error("Order Managament Secret not known by Platform.")
         return Response(status=400)
-    app.logger.debug("Order secret file was read.")
     # Operation Management service is the only entity allowed to perform this operation
-    if payload['secret'] != order_secret:
+    if not secret_matches(payload.get('secret'), order_secret):
         app.logger.error("Order Process request not issued by Order Management Service.")
         return Response(status=401)
-    
-    client_id = payload['client_id']
-    from_client_id = payload['from_client_id']
-    symbol = payload['symbol']
-    quantity = int(payload['quantity'])
-    price = float(payload['price'])
-    type = payload['type']
 
-    # Request client's portfolio from Portfolio Management Service
-    response = requests.get(f"http://portfolio-mgmt:5000/portfolio/{client_id}")
-    app.logger.debug(f"Got response for GET PORTFOLIO for {client_id} from Portfolio Management Service")
-    
-    if response is None:
-        app.logger.error(f"Portfolio for {client_id} could not be fetched.")
+    # Either a single fill, or several under 'fills' settled together
+    batch = 'fills' in payload
+    fills = payload['fills'] if batch else [payload]
+    if not batch and payload.get('fill_id') is None and request.headers.get('Idempotency-Key'):
+        payload['fill_id'] = request.headers['Idempotency-Key']
+
+    try:
+        settled, duplicates = settlement_engine.settle(fills)
+    except (KeyError, TypeError, ValueError) as e:
+        app.logger.error("Invalid fill in settlement request: %s", e)
         return Response(status=400)
-    elif response.status_code != 200:
-        app.logger.error(f"Portfolio for {client_id} could not be fetched.")
-        return Response(status=response.status_code)
-    
-    app.logger.info(f"Portfolio for {client_id} found.")
-    portfolio = response.json()
-    # Get portfolio details about cash and symbol, if available
-    cash_balance = float(portfolio['Cash'])
-    old_quantity = int(portfolio[symbol]) if not portfolio.get(symbol) is None else 0 
-    # Buy Order
-    if type == 'B':
-        paid_amount = price * quantity
-        new_cash_balance_client = cash_balance - paid_amount
-        new_quantity = old_quantity + quantity 
-        client_payload = {
-            "Cash": new_cash_balance_client,
-            symbol: new_quantity
-        }
-        # Update portfolio of the other client as well if they are not an external client
-        if from_client_id != 'external':
-            app.logger.info("Transaction involving internal client")
-            from_response = requests.get(f"http://portfolio-mgmt:5000/portfolio/{from_client_id}")
-            if from_response is None:
-                app.logger.error(f"Portfolio for {from_client_id} could not be fetched.")
-                return Response(status=400)
-            elif from_response.status_code != 200:
-                app.logger.error(f"Portfolio for {from_client_id} could not be fetched.")
-                return Response(status=from_response.status_code)
-            app.logger.info(f"Portfolio for {client_id} found.")    
-
-            from_portfolio = from_response.json()
-            from_cash_balance = float(from_portfolio['Cash'])
-            from_quantity = int(from_portfolio[symbol]) if not from_portfolio.get(symbol) is None else 0 
-            new_cash_balance_from_client = from_cash_balance + paid_amount
-            from_client_payload = {
-                "Cash": new_cash_balance_from_client,
-                symbol: from_quantity - quantity
-            }
-
-            app.logger.info(f"Updating portfolio for {from_client_id} with: cash={new_cash_balance_from_client}, {symbol}={from_quantity - quantity}.")
-            from_response = requests.put(f"http://portfolio-mgmt:5000/portfolio/{from_client_id}", json=from_client_payload)
-            if from_response.status_code != 200:
-                app.logger.error(f"Portfolio for {from_client_id} could not be updated.")
-                return Response(status=from_response.status_code)
-            app.logger.info(f"Portfolio for {from_client_id} updated.")
-        else:
-            app.logger.info("Transaction involving external client")
-        app.logger.info(f"Updating portfolio for {client_id} with: cash={new_cash_balance_client}, {symbol}={new_quantity}.")
-        response = requests.put(f"http://portfolio-mgmt:5000/portfolio/{client_id}", json=client_payload)
-        if response.status_code != 200:
-            app.logger.error(f"Portfolio for {client_id} could not be updated.")
-            return Response(status=response.status_code)
-        app.logger.info(f"Portfolio for {client_id} updated.")
-    # Sell Order
-    else:
-        paid_amount = price * quantity
-        new_cash_balance_client = cash_balance + paid_amount
-        new_quantity = old_quantity - quantity
-        client_payload = {
-            "Cash": new_cash_balance_client,
-            symbol: new_quantity
-        }
-        if from_client_id != 'external':
-            app.logger.info("Transaction involving internal client")
-            from_response = requests.get(f"http://portfolio-mgmt:5000/portfolio/{from_client_id}")
-            if from_response is None:
-                app.logger.error(f"Portfolio for {from_client_id} could not be fetched.")
-                return Response(status=400)
-            elif from_response.status_code != 200:
-                app.logger.error(f"Portfolio for {from_client_id} could not be fetched.")
-                return Response(status=from_response.status_code)
-            
-            from_portfolio = from_response.json()
-            from_cash_balance = float(from_portfolio['Cash'])
-            from_quantity = int(from_portfolio[symbol]) if not from_portfolio.get(symbol) is None else 0 
-            new_cash_balance_from_client = from_cash_balance - paid_amount
-            from_client_payload = {
-                "Cash": new_cash_balance_from_client,
-                symbol: from_quantity + quantity
-            }
-            app.logger.info(f"Updating portfolio for {from_client_id} with: cash={new_cash_balance_from_client}, {symbol}={from_quantity + quantity}.")
-            from_response = requests.put(f"http://portfolio-mgmt:5000/portfolio/{from_client_id}", json=from_client_payload)
-            if from_response.status_code != 200:
-                app.logger.error(f"Portfolio for {from_client_id} could not be updated.")
-                return Response(status=from_response.status_code)
-            app.logger.info(f"Portfolio for {from_client_id} updated.")
-        else:
-            app.logger.info("Transaction involving external client")
-        app.logger.info(f"Updating portfolio for {client_id} with: cash={new_cash_balance_client}, {symbol}={new_quantity}.")
-        response = requests.put(f"http://portfolio-mgmt:5000/portfolio/{client_id}", json=client_payload)
-        if response.status_code != 200:
-            app.logger.error(f"Portfolio for {client_id} could not be updated.")
-            return Response(status=response.status_code)
-        app.logger.info(f"Portfolio for {client_id} updated.")
+    except SettlementError as e:
+        app.logger.error("Settlement failed: %s", e)
+        return Response(status=e.status)
 
+    app.logger.info("Settled %s fills (%s already settled).", settled, duplicates)
+    if batch:
+        return json_response({'settled': settled, 'duplicates': duplicates})
     return Response(status=200)
 
+def unpriced(symbol, e):
+    app.logger.warning("Quote for %s could not be fetched to value a portfolio: %s", symbol, e)
+    return None
+
 @app.route('/portfolio', methods=['GET'])
 def get_portfolio():
     # Verify if the client is authenticated
     res = verify(request)
-    app.logger.debug(f"Request token was verified.")
+    app.logger.debug("Request token was verified.")
     if res is None:
         app.logger.error("Client provided invalid token for authentication.")
         return Response(status=401)
     
     clientID = res['clientID']
-    app.logger.debug(f"Client ID is {clientID}")
+    app.logger.debug("Client ID is %s", clientID)
 
     # Request client's portfolio from Portfolio Management Service
-    response = requests.get(f"http://portfolio-mgmt:5000/portfolio/{clientID}")
-    app.logger.debug(f"Got response for GET PORTFOLIO for {clientID} from Portfolio Management Service")
-
-    if not response is None and response.status_code == 200:
-        app.logger.info(f"Portfolio for {clientID} found.")
-        value = 0.0
+    portfolio, status = portfolios.fetch(clientID)
+    app.logger.debug("Got response for GET PORTFOLIO for %s from Portfolio Management Service", clientID)
+
+    if portfolio is not None:
+        app.logger.info("Portfolio for %s found.", clientID)
+        valuation_engine.set_holdings(clientID, portfolio)
+        # Prices normally arrive in the background, as long as the refresher
+        # keeps every held symbol warm; only fetch the ones that are missing
+        # or too old. Symbols that can't be fetched are left under 'missing'
+        # (or keep their older price) rather than failing the whole request.
+        for symbol in valuation_engine.symbols(clientID):
+            yfinance.trackQuote(symbol)
+        stale = valuation_engine.stale(clientID)
+        if stale:
+            app.logger.debug("Fetching %s quotes to value %s's portfolio", len(stale), clientID)
+            getQuotesBatch(stale, fallback=unpriced)
+        valuation = valuation_engine.value(clientID)
+        if valuation['missing']:
+            app.logger.error("No quotes for %s, left out of %s's portfolio value", ','.join(valuation['missing']), clientID)
+
+        app.logger.debug("Calculated total value for %s's portfolio", clientID)
         # Append total value of portfolio to response
-        portfolio = response.json()
-        for symbol in portfolio:
-            if symbol == 'Cash':
-                value += float(portfolio[symbol])
-            else:
-                price = getQuotes(symbol).get('price')
-                quantity = int(portfolio[symbol])
-                value += price * quantity
-
-        
-        app.logger.debug(f"Calculated total value for {clientID}'s portfolio")
-        portfolio['Value'] = value
-        return Response(json.dumps(portfolio), status=response.status_code, mimetype="application/json")
-    app.logger.error(f"Portfolio for {clientID} could not be fetched.")
+        portfolio['Value'] = valuation['total']
+        portfolio['Valuation'] = valuation
+        return json_response(portfolio, status)
+    app.logger.error("Portfolio for %s could not be fetched.", clientID)
     return Response(status=400)
 
 @app.route('/deposit', methods=['POST'])
 def deposit():
     # Verify if the client is authenticated
     res = verify(request)
-    app.logger.debug(f"Request token was verified.")
+    app.logger.debug("Request token was verified.")
     if res is None:
         app.logger.error("Client provided invalid token for authentication.")
         return Response(status=401)
     
     clientID = res['clientID']
-    app.logger.debug(f"Client ID is {clientID}")
+    app.logger.debug("Client ID is %s", clientID)
 
     # Request client's portfolio from Portfolio Management Service
-    response = requests.get(f"http://portfolio-mgmt:5000/portfolio/{clientID}")
-    app.logger.debug(f"Got response for GET PORTFOLIO for {clientID} from Portfolio Management Service")
-    if not response is None and response.status_code == 200:
-        app.logger.info(f"Portfolio for {clientID} found.")
-        data = response.json()
+    # The new balance is computed from it, so it must not be a cached copy
+    data, status = portfolios.fetch(clientID, fresh=True)
+    app.logger.debug("Got response for GET PORTFOLIO for %s from Portfolio Management Service", clientID)
+    if data is not None:
+        app.logger.info("Portfolio for %s found.", clientID)
         old_cash_balance = float(data['Cash'])
 
         # Get request body
@@ -500,35 +840,35 @@ def deposit():
         new_cash_balance = old_cash_balance + deposited_cash
 
         update_payload = {"Cash": str(new_cash_balance)}
-        app.logger.info(f"Updating {clientID} portfolio with cash={new_cash_balance}")
-        response = requests.put(f"http://portfolio-mgmt:5000/portfolio/{clientID}", json=update_payload)
+        app.logger.info("Updating %s portfolio with cash=%s", clientID, new_cash_balance)
+        response = portfolios.update(clientID, update_payload)
 
         if response and response.status_code == 200:
-            app.logger.info(f"Portfolio for {clientID} updated.")
+            app.logger.info("Portfolio for %s updated.", clientID)
         else:
-            app.logger.error(f"Portfolio for {clientID} was not updated.")
+            app.logger.error("Portfolio for %s was not updated.", clientID)
         return Response(response.text, status=response.status_code, mimetype="json/application")
-    app.logger.error(f"Portfolio for {clientID} could not be fetched.")    
+    app.logger.error("Portfolio for %s could not be fetched.", clientID)    
     return Response(status=400)
 
 @app.route('/withdraw', methods=['POST'])
 def withdraw():
     # Verify if the client is authenticated
     res = verify(request)
-    app.logger.debug(f"Request token was verified.")
+    app.logger.debug("Request token was verified.")
     if res is None:
         app.logger.error("Client provided invalid token for authentication.")
         return Response(status=401)
     
     clientID = res['clientID']
-    app.logger.debug(f"Client ID is {clientID}")
+    app.logger.debug("Client ID is %s", clientID)
 
     # Request client's portfolio from Portfolio Management Service
-    response = requests.get(f"http://portfolio-mgmt:5000/portfolio/{clientID}")
-    app.logger.debug(f"Got response for GET PORTFOLIO for {clientID} from Portfolio Management Service")
-    if not response is None and response.status_code == 200:
-        app.logger.info(f"Portfolio for {clientID} found.")
-        data = response.json()
+    # The new balance is computed from it, so it must not be a cached copy
+    data, status = portfolios.fetch(clientID, fresh=True)
+    app.logger.debug("Got response for GET PORTFOLIO for %s from Portfolio Management Service", clientID)
+    if data is not None:
+        app.logger.info("Portfolio for %s found.", clientID)
         cash_balance = float(data['Cash'])
 
         # Get request body
@@ -538,20 +878,21 @@ def withdraw():
         new_cash_balance = cash_balance - withdrawn_cash
 
         if new_cash_balance < 0.0:
-            app.logger.error(f"Insufficient funds ({cash_balance}) to withdraw {withdrawn_cash} for client {clientID}")
-            return Response(json.dumps({'error': 'insufficient funds'}), status=400, mimetype='application/json')
+            app.logger.error("Insufficient funds (%s) to withdraw %s for client %s", cash_balance, withdrawn_cash, clientID)
+            return json_response({'error': 'insufficient funds'}, 400)
 
         update_payload = {"Cash": str(new_cash_balance)}
-        app.logger.info(f"Updating {clientID} portfolio with cash={new_cash_balance}")
-        response = requests.put(f"http://portfolio-mgmt:5000/portfolio/{clientID}", json=update_payload)
+        app.logger.info("Updating %s portfolio with cash=%s", clientID, new_cash_balance)
+        response = portfolios.update(clientID, update_payload)
 
         if response and response.status_code == 200:
-            app.logger.info(f"Portfolio for {clientID} updated.")
+            app.logger.info("Portfolio for %s updated.", clientID)
         else:
-            app.logger.error(f"Portfolio for {clientID} was not updated.")
+            app.logger.error("Portfolio for %s was not updated.", clientID)
         return Response(response.text, status=response.status_code, mimetype="json/application")
-    app.logger.error(f"Portfolio for {clientID} could not be fetched.")        
+    app.logger.error("Portfolio for %s could not be fetched.", clientID)        
     return Response(status=400)
 
 if __name__ == "__main__":
+    warmup.run()
     app.run(debug=False)
\ No newline at end of file
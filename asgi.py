@@ -0,0 +1,450 @@
+# Asynchronous serving mode: run with `uvicorn asgi:app`.
+#
+# The routes that fan out to several services are served natively on asyncio
+# with a non-blocking HTTP client, running independent calls concurrently.
+# Every other route is handed to the Flask app in app.py, so both modes expose
+# the same API.
+import asyncio
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Match, Mount, Route
+
+import depth
+import downstream
+import logs
+import metrics
+import portfolios
+import ratelimit
+import serialization
+import tokens
+import warmup
+import yfinance
+from app import (QUOTE_STALE_FALLBACK, STREAM_HEARTBEAT, STREAM_MAX_SYMBOLS, app as flask_app, check_rate,
+                 quote_hub, valuation_engine)
+from breaker import CircuitOpen
+from downstream import DEFAULTS, ORDER_MGMT_URL, PORTFOLIO_MGMT_URL, SERVICES, Saturated
+from ratelimit import RateLimited
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS = int(os.getenv('ASGI_MAX_CONNECTIONS', '200'))
+# Threads serving the routes delegated to Flask
+WSGI_WORKERS = int(os.getenv('ASGI_WSGI_WORKERS', '10'))
+# Quote stream subscribers only cost a task each here, see stream_quotes
+STREAM_MAX_SUBSCRIBERS = int(os.getenv('ASGI_STREAM_MAX_SUBSCRIBERS', '10000'))
+
+client = None
+
+# Fetches in progress, so concurrent misses for a symbol share one
+_quote_fetches = {}
+_depth_fetches = {}
+_portfolio_fetches = {}
+
+_stream_subscribers = 0
+
+
+class DownstreamTransport(httpx.AsyncBaseTransport):
+    # Applies the per-host circuit breakers of the downstream module and
+    # records the same metrics as downstream.request()
+    def __init__(self, transport):
+        self._transport = transport
+
+    async def handle_async_request(self, request):
+        host = request.url.host
+        service = SERVICES.get(host, host)
+        breaker = downstream.breaker(host)
+        try:
+            # Waiting for a slot would block the event loop
+            downstream.admit(blocking=False)
+        except Saturated:
+            metrics.DOWNSTREAM_ERRORS.inc(service, 'Saturated')
+            raise
+        try:
+            breaker.before()
+        except CircuitOpen:
+            downstream.release()
+            metrics.DOWNSTREAM_ERRORS.inc(service, 'CircuitOpen')
+            raise
+
+        metrics.DOWNSTREAM_IN_FLIGHT.inc(service)
+        started = time.perf_counter()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except httpx.HTTPError as e:
+            breaker.record(False)
+            metrics.DOWNSTREAM_ERRORS.inc(service, type(e).__name__)
+            metrics.DOWNSTREAM_LATENCY.observe(time.perf_counter() - started, service, request.method, 'error')
+            raise
+        finally:
+            downstream.release()
+            metrics.DOWNSTREAM_IN_FLIGHT.dec(service)
+        breaker.record(response.status_code < 500)
+        metrics.DOWNSTREAM_LATENCY.observe(time.perf_counter() - started, service, request.method, str(response.status_code))
+        if response.status_code >= 500:
+            metrics.DOWNSTREAM_ERRORS.inc(service, str(response.status_code))
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+@asynccontextmanager
+async def lifespan(app):
+    global client
+    client = httpx.AsyncClient(
+        timeout=httpx.Timeout(DEFAULTS['READ_TIMEOUT'], connect=DEFAULTS['CONNECT_TIMEOUT']),
+        limits=httpx.Limits(max_connections=MAX_CONNECTIONS,
+                            max_keepalive_connections=DEFAULTS['POOL_SIZE']),
+        transport=DownstreamTransport(httpx.AsyncHTTPTransport(retries=DEFAULTS['RETRIES'])))
+    # Serving starts once this returns. The native routes reach the services
+    # through client, so its pool is warmed alongside the requests sessions.
+    connections = [warm_connection(url) for url in warmup.SERVICES.values()
+                   for _ in range(warmup.WARMUP_CONNECTIONS if warmup.WARMUP_ENABLED else 0)]
+    await asyncio.gather(asyncio.get_running_loop().run_in_executor(None, warmup.run), *connections)
+    try:
+        yield
+    finally:
+        await client.aclose()
+        client = None
+
+async def warm_connection(url):
+    try:
+        await client.head(url)
+    except (httpx.HTTPError, CircuitOpen, Saturated):
+        pass
+
+def empty(status):
+    # Matches the body-less responses Flask produces
+    return Response(status_code=status, media_type='text/html')
+
+def json_response(content, status=200):
+    return Response(serialization.dumps(content), status_code=status, media_type='application/json')
+
+def proxy(response):
+    # Hand a downstream response on as is, without decoding and re-encoding it
+    return Response(response.content, status_code=response.status_code,
+                    media_type=response.headers.get('Content-Type', 'application/json'))
+
+async def verify(request):
+    authHeader = request.headers.get('authorization')
+    if authHeader is None:
+        logger.error("No token provided.")
+        return None
+
+    result = await tokens.verify_token_async(authHeader, client)
+    if result is None:
+        logger.error("Token is invalid.")
+    else:
+        check_rate(request.scope['endpoint'].__name__, result['clientID'])
+    return result
+
+async def _fetch_quote(symbol):
+    page = await client.get(yfinance.buildUrl(symbol))
+    # Parsing is CPU bound, keep it off the event loop
+    content = await asyncio.get_event_loop().run_in_executor(None, yfinance.parse, page.content, symbol)
+    yfinance.storeQuote(symbol, content)
+    return content
+
+async def get_quote(symbol):
+    quote = yfinance.cachedQuote(symbol)
+    if quote is None:
+        if yfinance.isUnknown(symbol):
+            return None
+        quote = await coalesce(_quote_fetches, symbol, _fetch_quote)
+        if quote is None:
+            return None
+        quote = dict(quote)
+    # Only symbols that exist are kept warm
+    yfinance.trackQuote(symbol)
+    return quote
+
+async def coalesce(fetches, key, fetch):
+    # Run fetch(key) once for all concurrent callers asking for the same key
+    task = fetches.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch(key))
+        fetches[key] = task
+        task.add_done_callback(lambda _: fetches.pop(key, None))
+    # Shield so one cancelled caller doesn't cancel the fetch for the others
+    return await asyncio.shield(task)
+
+def parse_order(body):
+    payload = serialization.loads(body)
+    return int(payload['quantity']), float(payload['price'])
+
+async def _fetch_depth(symbol):
+    response = await client.get(f"{ORDER_MGMT_URL}/depth/{symbol}")
+    return depth.store(symbol, serialization.body(response) if response.status_code == 200 else None)
+
+async def _fetch_portfolio(client_id):
+    response = await client.get(f"{PORTFOLIO_MGMT_URL}/portfolio/{client_id}")
+    if response.status_code != 200:
+        return None
+    return portfolios.store(client_id, serialization.body(response))
+
+async def get_depth(symbol):
+    found, book = depth.cached(symbol)
+    if found:
+        return book
+    return await coalesce(_depth_fetches, symbol, _fetch_depth)
+
+def stale_quote(symbol, e):
+    # Yahoo! is failing: fall back to the last quote we had, without depth
+    quotes = yfinance.staleQuote(symbol) if QUOTE_STALE_FALLBACK else None
+    if quotes is None:
+        raise e
+    logger.warning("Returning stale quote for %s", symbol)
+    return Response(serialization.dumps(quotes), status_code=200, media_type='application/json',
+                    headers={'Warning': '110 - "Response is Stale"'})
+
+def client_address(request):
+    return ratelimit.client_address(request.client.host if request.client else None,
+                                    request.headers.get('x-forwarded-for'))
+
+async def stream_quotes(request):
+    # The Flask route's Server-Sent Events stream, without holding a thread
+    # per subscriber: the quote hub wakes the subscriber's task instead
+    check_rate('stream_quotes', client_address(request))
+    symbols = [symbol.strip() for symbol in request.query_params.get('symbols', '').split(',') if symbol.strip()]
+    symbols = list(dict.fromkeys(symbols))
+    if not symbols or len(symbols) > STREAM_MAX_SYMBOLS:
+        logger.error("Invalid stream subscription for symbols %s", symbols)
+        return json_response({'error': f'provide between 1 and {STREAM_MAX_SYMBOLS} symbols'}, 400)
+    if _stream_subscribers >= STREAM_MAX_SUBSCRIBERS:
+        logger.warning("Quote stream refused, %s subscribers already connected.", STREAM_MAX_SUBSCRIBERS)
+        return Response(status_code=503, headers={'Retry-After': str(math.ceil(STREAM_HEARTBEAT))})
+
+    async def events():
+        # Subscribes once the response is being sent, so that nothing is left
+        # behind if it never is
+        global _stream_subscribers
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        _stream_subscribers += 1
+        subscription = quote_hub.subscribe(symbols, notify=lambda: loop.call_soon_threadsafe(wakeup.set))
+        logger.info("Client subscribed to quote stream for %s", ','.join(symbols))
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    await asyncio.wait_for(wakeup.wait(), STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing the connection and detects gone clients
+                    yield ": keep-alive\n\n"
+                    continue
+                wakeup.clear()
+                for symbol, snapshot in subscription.take():
+                    yield f"event: quote\ndata: {serialization.dumps(dict(snapshot, symbol=symbol)).decode()}\n\n"
+        finally:
+            quote_hub.unsubscribe(subscription)
+            _stream_subscribers -= 1
+            logger.info("Client unsubscribed from quote stream for %s", ','.join(symbols))
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return StreamingResponse(events(), media_type='text/event-stream', headers=headers)
+
+async def get_quotes(request):
+    check_rate('get_quotes', client_address(request))
+    symbol = request.path_params['symbol']
+    if request.query_params.get('depth', 'true').lower() in ('false', '0', 'no'):
+        try:
+            quotes = await get_quote(symbol)
+        except CircuitOpen as e:
+            return stale_quote(symbol, e)
+        if quotes is None:
+            logger.error("The symbol %s could not be found", symbol)
+            return empty(404)
+        return json_response(quotes)
+
+    quotes, book = await asyncio.gather(get_quote(symbol), get_depth(symbol), return_exceptions=True)
+
+    if isinstance(quotes, CircuitOpen):
+        return stale_quote(symbol, quotes)
+    if isinstance(quotes, Exception):
+        raise quotes
+    if quotes is None:
+        logger.error("The symbol %s could not be found", symbol)
+        return empty(404)
+    if isinstance(book, CircuitOpen):
+        # Order Management is failing; the quote is still worth returning
+        book = None
+    if isinstance(book, Exception):
+        raise book
+
+    if book is not None:
+        logger.info("Returning quote for %s with depth information", symbol, extra=logs.SAMPLED)
+        quotes['depth'] = book
+    else:
+        logger.info("Returning quote for %s without depth information", symbol, extra=logs.SAMPLED)
+    return json_response(quotes)
+
+async def place_order(request, type):
+    symbol = request.path_params['symbol']
+    # Token verification and reading the body don't depend on each other
+    res, body = await asyncio.gather(verify(request), request.body())
+    if res is None:
+        logger.error("Client provided invalid token for authentication.")
+        return empty(401)
+
+    clientID = res['clientID']
+    try:
+        quantity, price = parse_order(body)
+    except (ValueError, KeyError, TypeError):
+        return empty(400)
+
+    response = await client.get(f"{PORTFOLIO_MGMT_URL}/portfolio/{clientID}")
+    if response.status_code != 200:
+        logger.error("Portfolio for client %s not found", clientID)
+        return json_response({'error': 'portfolio not found'}, 400)
+
+    portfolio = serialization.body(response)
+    if type == 'B':
+        if float(portfolio['Cash']) < price * quantity:
+            logger.error("Client %s has insufficient funds to place buy order.", clientID)
+            return json_response({'error': 'insufficient funds'}, 400)
+    else:
+        if portfolio.get(symbol) is None:
+            logger.error("Client %s does not have symbol %s in their portfolio.", clientID, symbol)
+            return json_response({'error': 'symbol not found in portfolio'}, 400)
+        elif float(portfolio[symbol]) < quantity:
+            logger.error("Client %s does not have enough quantity of %s in their portfolio.", clientID, symbol)
+            return json_response({'error': 'quantity of order exceeds available amount'}, 400)
+
+    order_payload = {
+        "client_id": clientID,
+        "symbol": symbol,
+        "type": type,
+        "quantity": quantity,
+        "price": price,
+        "placed_at": datetime.now().isoformat()
+    }
+    logger.info("%s: %s %s %s @ %s", clientID, 'BUY' if type == 'B' else 'SELL', quantity, symbol, price)
+    response = await client.post(f"{ORDER_MGMT_URL}/orders", json=order_payload)
+    return proxy(response)
+
+async def place_buy_order(request):
+    return await place_order(request, 'B')
+
+async def place_sell_order(request):
+    return await place_order(request, 'S')
+
+async def get_orders(request):
+    res = await verify(request)
+    if res is None:
+        logger.error("Client provided invalid token for authentication.")
+        return empty(401)
+
+    clientID = res['clientID']
+    response = await client.get(f"{ORDER_MGMT_URL}/orders/client/{clientID}")
+    return proxy(response)
+
+async def get_portfolio(request):
+    res = await verify(request)
+    if res is None:
+        logger.error("Client provided invalid token for authentication.")
+        return empty(401)
+
+    clientID = res['clientID']
+    portfolio = portfolios.cached(clientID)
+    if portfolio is None:
+        portfolio = await coalesce(_portfolio_fetches, clientID, _fetch_portfolio)
+        if portfolio is None:
+            logger.error("Portfolio for %s could not be fetched.", clientID)
+            return empty(400)
+        portfolio = dict(portfolio)
+
+    valuation_engine.set_holdings(clientID, portfolio)
+    for symbol in valuation_engine.symbols(clientID):
+        yfinance.trackQuote(symbol)
+    stale = valuation_engine.stale(clientID)
+    if stale:
+        results = await asyncio.gather(*(get_quote(symbol) for symbol in stale), return_exceptions=True)
+        for symbol, result in zip(stale, results):
+            if isinstance(result, Exception):
+                logger.warning("Quote for %s could not be fetched to value a portfolio: %s", symbol, result)
+    valuation = valuation_engine.value(clientID)
+
+    portfolio['Value'] = valuation['total']
+    portfolio['Valuation'] = valuation
+    return json_response(portfolio)
+
+async def downstream_circuit_open(request, e):
+    logger.error("Downstream request refused: %s", e)
+    return Response(status_code=503, media_type='text/html', headers={'Retry-After': str(math.ceil(e.retry_after) or 1)})
+
+async def too_many_requests(request, e):
+    logger.warning("Request refused: %s", e)
+    return Response(status_code=429, media_type='text/html', headers={'Retry-After': str(math.ceil(e.retry_after) or 1)})
+
+async def downstream_timeout(request, e):
+    logger.error("Downstream request timed out: %s", e)
+    return empty(504)
+
+async def downstream_unavailable(request, e):
+    logger.error("Downstream request failed: %s", e)
+    return empty(503)
+
+class RequestMetrics(object):
+    # Records the natively served routes; the ones handed to Flask are
+    # recorded by app.py
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        route = self._route(scope) if scope['type'] == 'http' else None
+        if route is None:
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        metrics.REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            metrics.REQUESTS_IN_FLIGHT.dec()
+            labels = (route.path, scope['method'], str(status[0]))
+            metrics.REQUEST_LATENCY.observe(time.perf_counter() - started, *labels)
+            if status[0] >= 500:
+                metrics.REQUEST_ERRORS.inc(*labels)
+
+    @staticmethod
+    def _route(scope):
+        for route in routes:
+            if isinstance(route, Route) and route.matches(scope)[0] == Match.FULL:
+                return route
+        return None
+
+routes = [
+    # Ahead of /quotes/{symbol}, which would take 'stream' for a symbol
+    Route('/quotes/stream', stream_quotes, methods=['GET']),
+    Route('/quotes/{symbol}', get_quotes, methods=['GET']),
+    Route('/quotes/{symbol}/buy', place_buy_order, methods=['POST']),
+    Route('/quotes/{symbol}/sell', place_sell_order, methods=['POST']),
+    Route('/orders', get_orders, methods=['GET']),
+    Route('/portfolio', get_portfolio, methods=['GET']),
+    # Everything else is served by the Flask app
+    Mount('/', app=WSGIMiddleware(flask_app, workers=WSGI_WORKERS)),
+]
+
+app = Starlette(routes=routes, lifespan=lifespan, middleware=[Middleware(RequestMetrics)], exception_handlers={
+    RateLimited: too_many_requests,
+    Saturated: too_many_requests,
+    CircuitOpen: downstream_circuit_open,
+    httpx.TimeoutException: downstream_timeout,
+    httpx.HTTPError: downstream_unavailable,
+})
@@ -0,0 +1,45 @@
+# Micro-benchmark of the quote extractors over saved Yahoo! Finance pages.
+#
+#   python benchmarks/extract_bench.py [iterations]
+#
+# Every fixture in benchmarks/fixtures/<SYMBOL>.html is parsed by each
+# extractor in yfinance.extract.EXTRACTORS. The bundled AAPL.html is a
+# synthetic approximation of a quote page, see the note at its top.
+import glob
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from yfinance.extract import EXTRACTORS
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def bench(extractor, content, symbol, iterations):
+    timer = timeit.Timer(lambda: extractor(content, symbol))
+    # Best of 5 rounds, reported per parse
+    return min(timer.repeat(repeat=5, number=iterations)) / iterations
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    for path in sorted(glob.glob(os.path.join(FIXTURES, '*.html'))):
+        symbol = os.path.splitext(os.path.basename(path))[0]
+        with open(path, 'rb') as file:
+            content = file.read()
+        print(f"{symbol} ({len(content) / 1024:.0f} KiB)")
+
+        timings = {}
+        for name, extractor in EXTRACTORS.items():
+            quote = extractor(content, symbol)
+            timings[name] = bench(extractor, content, symbol, iterations)
+            print(f"  {name:<10} {timings[name] * 1000:8.3f} ms/parse  {quote}")
+
+        for name, seconds in timings.items():
+            if name != 'xpath':
+                print(f"  {name} is {timings['xpath'] / seconds:.1f}x the speed of xpath")
+
+if __name__ == '__main__':
+    main()
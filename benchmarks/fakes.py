@@ -0,0 +1,259 @@
+# Local stand-ins for the services the platform depends on: auth,
+# order-mgmt, portfolio-mgmt and Yahoo! Finance. Each one listens on its own
+# loopback address so downstream metrics and pools stay per service.
+#
+#   python benchmarks/fakes.py [--latency MS] [--jitter MS] [--error-rate P] [--positions N]
+#
+# prints the environment that points app.py at them and serves until
+# interrupted. load.py starts them itself.
+import argparse
+import glob
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+HOSTS = {
+    'auth': '127.0.0.2',
+    'order-mgmt': '127.0.0.3',
+    'portfolio-mgmt': '127.0.0.4',
+    'yahoo': '127.0.0.5',
+}
+
+# Symbols held in generated portfolios and quoted by the Yahoo stand-in
+SYMBOLS = ['AAPL', 'MSFT', 'GOOG', 'AMZN', 'META', 'NVDA', 'TSLA', 'NFLX', 'INTC', 'AMD',
+           'ORCL', 'IBM', 'CSCO', 'ADBE', 'CRM', 'QCOM', 'TXN', 'AVGO', 'PYPL', 'UBER']
+
+
+class Options(object):
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, positions=10):
+        # Latencies in seconds
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.positions = positions
+
+
+def symbols(count):
+    # count symbols, made up past the ones in SYMBOLS
+    return [SYMBOLS[i] if i < len(SYMBOLS) else f'SYM{i}' for i in range(count)]
+
+def token(client_id):
+    # Bearer token the auth stand-in resolves to client_id
+    return f'Bearer client-{client_id}'
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; with Nagle's algorithm the
+    # second one waits for the client's delayed ACK, ~40 ms per call
+    disable_nagle_algorithm = True
+    routes = ()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=None, content_type='application/json'):
+        if body is None:
+            data = b''
+        elif isinstance(body, bytes):
+            data = body
+        else:
+            data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _dispatch(self):
+        options = self.server.options
+        delay = options.latency + random.uniform(0, options.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        if options.error_rate and random.random() < options.error_rate:
+            return self._reply(503)
+        path = self.path.split('?', 1)[0]
+        for method, pattern, handler in self.routes:
+            match = re.fullmatch(pattern, path)
+            if method == self.command and match:
+                return self._reply(*handler(self, body, *match.groups()))
+        self._reply(404)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+
+class _AuthHandler(_Handler):
+    def _verify(request, body):
+        match = re.fullmatch(r'Bearer client-(.+)', request.headers.get('Authorization', ''))
+        return (200, {'clientID': match.group(1)}) if match else (401,)
+
+    routes = [('POST', r'/verify', _verify)]
+
+
+class _OrderHandler(_Handler):
+    # Orders are kept and returned in order-mgmt's own schema, which differs
+    # from the payloads the platform sends it
+    FIELDS = {'client_id': 'ClientID', 'symbol': 'Symbol', 'type': 'Type', 'quantity': 'Quantity',
+              'price': 'Price', 'placed_at': 'PlacedAt'}
+
+    def _stored(body):
+        return {_OrderHandler.FIELDS[key]: value for key, value in body.items() if key in _OrderHandler.FIELDS}
+
+    def _place(request, body):
+        with request.server.lock:
+            request.server.next_id += 1
+            order = dict(_OrderHandler._stored(body), ID=request.server.next_id)
+            request.server.orders[order['ID']] = order
+        return 201, order
+
+    def _client_orders(request, body, client_id):
+        with request.server.lock:
+            orders = [order for order in request.server.orders.values() if order.get('ClientID') == client_id]
+        return 200, orders[-20:]
+
+    def _order(request, body, id):
+        order = request.server.orders.get(int(id))
+        return (200, order) if order is not None else (404,)
+
+    def _update(request, body, id):
+        order = request.server.orders.get(int(id))
+        if order is None:
+            return 404,
+        order.update(_OrderHandler._stored(body))
+        return 200, order
+
+    def _delete(request, body, id):
+        return (200,) if request.server.orders.pop(int(id), None) is not None else (404,)
+
+    def _depth(request, body, symbol):
+        price = 100.0 + sum(map(ord, symbol)) % 100
+        return 200, {
+            'bids': [[round(price - 0.01 * i, 2), 100 * i] for i in range(1, 11)],
+            'asks': [[round(price + 0.01 * i, 2), 100 * i] for i in range(1, 11)],
+        }
+
+    routes = [
+        ('POST', r'/orders', _place),
+        ('GET', r'/orders/client/([^/]+)', _client_orders),
+        ('GET', r'/orders/(\d+)', _order),
+        ('PUT', r'/orders/(\d+)', _update),
+        ('DELETE', r'/orders/(\d+)', _delete),
+        ('GET', r'/depth/([^/]+)', _depth),
+    ]
+
+
+class _PortfolioHandler(_Handler):
+    def _portfolio(server, client_id):
+        # Created on first use with options.positions holdings
+        portfolio = server.portfolios.get(client_id)
+        if portfolio is None:
+            portfolio = {'Cash': 1e9}
+            portfolio.update((symbol, 1000000) for symbol in symbols(server.options.positions))
+            portfolio = server.portfolios.setdefault(client_id, portfolio)
+        return portfolio
+
+    def _get(request, body, client_id):
+        with request.server.lock:
+            return 200, dict(_PortfolioHandler._portfolio(request.server, client_id))
+
+    def _put(request, body, client_id):
+        with request.server.lock:
+            _PortfolioHandler._portfolio(request.server, client_id).update(body)
+        return 200, body
+
+    routes = [
+        ('GET', r'/portfolio/([^/]+)', _get),
+        ('PUT', r'/portfolio/([^/]+)', _put),
+    ]
+
+
+class _YahooHandler(_Handler):
+    def _quote(request, body, symbol):
+        # Symbols without a saved page get a copy of the first one, relabelled
+        pages = request.server.pages
+        page = pages.get(symbol)
+        if page is None:
+            template, content = next(iter(sorted(pages.items())))
+            page = pages.setdefault(symbol, content.replace(template.encode(), symbol.encode()))
+        return 200, page, 'text/html; charset=utf-8'
+
+    routes = [('GET', r'/quote/([^/]+)/?', _quote)]
+
+
+HANDLERS = {
+    'auth': _AuthHandler,
+    'order-mgmt': _OrderHandler,
+    'portfolio-mgmt': _PortfolioHandler,
+    'yahoo': _YahooHandler,
+}
+
+
+def _pages():
+    pages = {}
+    for path in glob.glob(os.path.join(FIXTURES, '*.html')):
+        with open(path, 'rb') as file:
+            pages[os.path.splitext(os.path.basename(path))[0]] = file.read()
+    return pages
+
+def start(options, port=0):
+    # Start every stand-in on a daemon thread. Returns (servers, env), env
+    # being the variables that point the platform at them.
+    servers = {}
+    env = {}
+    pages = _pages()
+    for name, handler in HANDLERS.items():
+        server = ThreadingHTTPServer((HOSTS[name], port), handler)
+        server.daemon_threads = True
+        server.options = options
+        server.lock = threading.Lock()
+        server.orders = {}
+        server.next_id = 0
+        server.portfolios = {}
+        server.pages = pages
+        threading.Thread(target=server.serve_forever, name=f'fake-{name}', daemon=True).start()
+        servers[name] = server
+    for name, variable in (('auth', 'AUTH_URL'), ('order-mgmt', 'ORDER_MGMT_URL'),
+                           ('portfolio-mgmt', 'PORTFOLIO_MGMT_URL'), ('yahoo', 'YFINANCE_BASE_URL')):
+        host, port = servers[name].server_address
+        env[variable] = f'http://{host}:{port}'
+    return servers, env
+
+def stop(servers):
+    for server in servers.values():
+        server.shutdown()
+        server.server_close()
+
+
+def add_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0.0, help='fixed latency of every fake call, in ms')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra uniformly random latency, in ms')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of fake calls answered with 503')
+    parser.add_argument('--positions', type=int, default=10, help='holdings per generated portfolio')
+
+def options_from(args):
+    return Options(args.latency / 1000, args.jitter / 1000, args.error_rate, args.positions)
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+
+    servers, env = start(options_from(args), args.port)
+    for variable, value in env.items():
+        print(f'export {variable}={value}', flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stop(servers)
+
+if __name__ == '__main__':
+    main()
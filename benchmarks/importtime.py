@@ -0,0 +1,47 @@
+# Import-time profile of the app: imports it in a fresh interpreter with
+# python -X importtime and lists the modules that took longest, counting
+# everything each one imported in turn. Run with --eager to compare against
+# LAZY_IMPORTS=false, i.e. every lazily imported module loaded up front.
+#
+#   python benchmarks/importtime.py [--module app|asgi] [--top N] [--eager]
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def profile(module, eager=False):
+    # [(module, self microseconds, cumulative microseconds, depth)] in import order
+    env = dict(os.environ, LAZY_IMPORTS='false' if eager else 'true')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(result.stderr)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(own), int(cumulative), (len(name) - len(name.lstrip()) - 1) // 2))
+    return imports
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='app', help='module to import')
+    parser.add_argument('--top', type=int, default=25, help='modules listed')
+    parser.add_argument('--eager', action='store_true', help='import everything up front (LAZY_IMPORTS=false)')
+    args = parser.parse_args()
+
+    imports = profile(args.module, args.eager)
+    total = next(cumulative for name, _, cumulative, depth in imports if name == args.module and depth == 0)
+    print(f"import {args.module}: {total / 1000:.1f} ms, {len(imports)} modules"
+          f" ({'eager' if args.eager else 'lazy'} imports)")
+    print(f"{'module':<40} {'self ms':>9} {'cumulative ms':>14}")
+    for name, own, cumulative, depth in sorted(imports, key=lambda item: -item[2])[:args.top]:
+        print(f"{name:<40} {own / 1000:>9.1f} {cumulative / 1000:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
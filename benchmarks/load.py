@@ -0,0 +1,223 @@
+# Load test of the platform against the local stand-ins in fakes.py. Starts
+# the stand-ins and the app in their own processes, drives a weighted mix of
+# quote, portfolio, order and settlement requests from a pool of client
+# threads, and reports throughput and latency percentiles per kind of
+# request. Runs entirely on loopback.
+#
+#   python benchmarks/load.py [--duration S] [--concurrency N] [--server flask|gunicorn|asgi]
+#                             [--mix quote=50,portfolio=20,buy=10,sell=10,settle=10]
+#                             [--latency MS] [--jitter MS] [--error-rate P] [--positions N]
+#
+# --target URL load-tests an app that is already running instead; it has to
+# be pointed at the stand-ins (see fakes.py) and read the order secret from
+# the file given with --secret-file.
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+
+import fakes
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+MIX = {'quote': 50, 'portfolio': 20, 'buy': 10, 'sell': 10, 'settle': 10}
+
+SERVERS = {
+    'flask': [sys.executable, '-m', 'flask', 'run', '--no-reload', '--host', '127.0.0.1', '--port', '{port}'],
+    'gunicorn': [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', '127.0.0.1:{port}', 'app:app'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', '{port}', '--no-access-log'],
+}
+
+
+class Workload(object):
+    def __init__(self, target, secret, clients, symbols, positions):
+        self.target = target
+        self.secret = secret
+        self.clients = [str(i) for i in range(clients)]
+        self.symbols = fakes.symbols(symbols)
+        # Sells only of symbols the generated portfolios hold
+        self.held = fakes.symbols(min(symbols, positions))
+
+    def quote(self, session):
+        return session.get(f'{self.target}/quotes/{random.choice(self.symbols)}')
+
+    def portfolio(self, session):
+        return session.get(f'{self.target}/portfolio', headers=self._auth())
+
+    def buy(self, session):
+        return session.post(f'{self.target}/quotes/{random.choice(self.symbols)}/buy', headers=self._auth(),
+                            json={'quantity': random.randint(1, 10), 'price': 100.0})
+
+    def sell(self, session):
+        return session.post(f'{self.target}/quotes/{random.choice(self.held)}/sell', headers=self._auth(),
+                            json={'quantity': random.randint(1, 10), 'price': 100.0})
+
+    def settle(self, session):
+        fill = {
+            'secret': self.secret,
+            'fill_id': uuid.uuid4().hex,
+            'client_id': random.choice(self.clients),
+            'from_client_id': random.choice(self.clients + ['external']),
+            'symbol': random.choice(self.symbols),
+            'quantity': random.randint(1, 10),
+            'price': 100.0,
+            'type': random.choice('BS'),
+        }
+        return session.post(f'{self.target}/orders/process', json=fill)
+
+    def _auth(self):
+        return {'Authorization': fakes.token(random.choice(self.clients))}
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return float('nan')
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def run(workload, mix, concurrency, duration, warmup):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    results = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    started = time.perf_counter()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+
+    def client():
+        session = requests.Session()
+        latencies = {name: [] for name in names}
+        failed = {name: 0 for name in names}
+        while True:
+            name = random.choices(names, weights)[0]
+            begin = time.perf_counter()
+            if begin >= deadline:
+                break
+            try:
+                ok = getattr(workload, name)(session).status_code < 400
+            except requests.exceptions.RequestException:
+                ok = False
+            end = time.perf_counter()
+            if begin >= measure_from:
+                latencies[name].append(end - begin)
+                failed[name] += not ok
+        with lock:
+            for name in names:
+                results[name].extend(latencies[name])
+                errors[name] += failed[name]
+
+    threads = [threading.Thread(target=client, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+def report(results, errors, duration):
+    print(f"{'request':<10} {'count':>8} {'req/s':>9} {'errors':>7} {'p50 ms':>9} {'p99 ms':>9} {'p999 ms':>9}")
+    everything = []
+    for name, latencies in list(results.items()) + [('total', None)]:
+        if latencies is None:
+            latencies = everything
+            failed = sum(errors.values())
+        else:
+            everything.extend(latencies)
+            failed = errors[name]
+        ordered = sorted(latencies)
+        print(f"{name:<10} {len(ordered):>8} {len(ordered) / duration:>9.1f} {failed:>7}"
+              f" {percentile(ordered, 0.5) * 1000:>9.2f} {percentile(ordered, 0.99) * 1000:>9.2f}"
+              f" {percentile(ordered, 0.999) * 1000:>9.2f}")
+
+def _parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in MIX:
+            raise argparse.ArgumentTypeError(f"unknown request kind {name!r}")
+        mix[name] = float(weight)
+    return mix
+
+def _start_fakes(args):
+    command = [sys.executable, os.path.join(ROOT, 'benchmarks', 'fakes.py'),
+               '--latency', str(args.latency), '--jitter', str(args.jitter),
+               '--error-rate', str(args.error_rate), '--positions', str(args.positions)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    env = {}
+    while len(env) < 4:
+        line = process.stdout.readline()
+        if not line:
+            raise RuntimeError("Stand-in services failed to start.")
+        variable, _, value = line.strip()[len('export '):].partition('=')
+        env[variable] = value
+    return process, env
+
+def _start_app(args, env):
+    command = [part.format(port=args.port) for part in SERVERS[args.server]]
+    env = {**os.environ, 'FLASK_APP': 'app.py', **env}
+    process = subprocess.Popen(command, cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL if args.quiet else None)
+    target = f'http://127.0.0.1:{args.port}'
+    for _ in range(300):
+        if process.poll() is not None:
+            raise RuntimeError("App exited during startup.")
+        try:
+            requests.get(f'{target}/metrics', timeout=1)
+            return process, target
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("App did not start listening.")
+
+def main():
+    parser = argparse.ArgumentParser()
+    fakes.add_arguments(parser)
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='unmeasured seconds before that')
+    parser.add_argument('--concurrency', type=int, default=32, help='client threads')
+    parser.add_argument('--clients', type=int, default=1000, help='distinct client ids')
+    parser.add_argument('--symbols', type=int, default=20, help='distinct symbols quoted and traded')
+    parser.add_argument('--mix', type=_parse_mix, default=MIX, help='weights per request kind')
+    parser.add_argument('--server', choices=sorted(SERVERS), default='flask')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--target', help='URL of an app that is already running')
+    parser.add_argument('--secret-file', help='order secret file of the app at --target')
+    parser.add_argument('--quiet', action='store_true', help="discard the app's log")
+    args = parser.parse_args()
+
+    processes = []
+    try:
+        if args.target:
+            target = args.target.rstrip('/')
+            # Sent exactly as read, like the app compares it
+            with open(args.secret_file) as file:
+                secret = file.read()
+        else:
+            secret = uuid.uuid4().hex
+            secret_file = tempfile.NamedTemporaryFile('w', suffix='.secret', delete=False)
+            secret_file.write(secret)
+            secret_file.close()
+            process, env = _start_fakes(args)
+            processes.append(process)
+            env['ORDER_SECRET_FILE'] = secret_file.name
+            process, target = _start_app(args, env)
+            processes.append(process)
+
+        workload = Workload(target, secret, args.clients, args.symbols, args.positions)
+        results, errors = run(workload, args.mix, args.concurrency, args.duration, args.warmup)
+        report(results, errors, args.duration)
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+        if not args.target:
+            os.unlink(secret_file.name)
+
+if __name__ == '__main__':
+    main()
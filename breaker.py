@@ -0,0 +1,111 @@
+import math
+import threading
+import time
+
+import requests
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpen(requests.exceptions.RequestException):
+    # Raised instead of calling a host whose breaker is open
+    def __init__(self, host, retry_after):
+        super().__init__(f"Circuit for {host} is open.")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class CircuitBreaker(object):
+    # Stops calls to a host once at least failure_rate of the calls made in
+    # the last window seconds failed (given min_calls or more were made).
+    # After open_for seconds up to `probes` calls are let through; the first
+    # to succeed closes the breaker again, a failure re-opens it.
+    def __init__(self, host, failure_rate=0.5, min_calls=20, window=10.0, open_for=5.0, probes=1, clock=time.monotonic):
+        self.host = host
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_for = open_for
+        self.probes = probes
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probing = 0
+        # Calls and failures per second of the window, oldest first
+        self._buckets = []
+
+        self.opened = 0
+        self.rejected = 0
+
+    def _prune(self, second):
+        # Must be called with the lock held
+        while self._buckets and self._buckets[0][0] <= second - self.window:
+            self._buckets.pop(0)
+
+    def _count(self, now, failed):
+        # Must be called with the lock held. Returns (calls, failures) in the window.
+        second = math.floor(now)
+        self._prune(second)
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+        self._buckets[-1][1] += 1
+        self._buckets[-1][2] += failed
+        return sum(bucket[1] for bucket in self._buckets), sum(bucket[2] for bucket in self._buckets)
+
+    def _open(self, now):
+        self.state = OPEN
+        self._opened_at = now
+        self._probing = 0
+        self._buckets = []
+        self.opened += 1
+
+    def before(self):
+        # Call before each request; raises CircuitOpen if it must not be made
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = self._clock()
+            if self.state == OPEN and now - self._opened_at >= self.open_for:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and self._probing < self.probes:
+                self._probing += 1
+                return
+            self.rejected += 1
+            retry_after = max(0.0, self._opened_at + self.open_for - now)
+        raise CircuitOpen(self.host, retry_after)
+
+    def record(self, success):
+        # Call with the outcome of every request before() let through
+        with self._lock:
+            now = self._clock()
+            if self.state == HALF_OPEN:
+                self._probing = max(0, self._probing - 1)
+                if success:
+                    self.state = CLOSED
+                    self._buckets = []
+                else:
+                    self._open(now)
+                return
+            if self.state == OPEN:
+                return
+            calls, failures = self._count(now, not success)
+            if calls >= self.min_calls and failures >= self.failure_rate * calls:
+                self._open(now)
+
+    def stats(self):
+        with self._lock:
+            self._prune(math.floor(self._clock()))
+            calls = sum(bucket[1] for bucket in self._buckets)
+            failures = sum(bucket[2] for bucket in self._buckets)
+            return {
+                'state': self.state,
+                'calls': calls,
+                'failures': failures,
+                'failureRate': failures / calls if calls else 0.0,
+                'opened': self.opened,
+                'rejected': self.rejected,
+            }
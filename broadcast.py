@@ -0,0 +1,53 @@
+# Messages shared by the worker processes of one server, such as cache
+# invalidations. A channel is an append-only file under PLATFORM_SHARED_DIR
+# (created by gunicorn.conf.py); each process picks up what any process
+# appended the next time it polls. Without the directory, e.g. under the
+# Flask dev server, there is only one process and nothing to share.
+import os
+import threading
+
+SHARED_DIR = os.getenv('PLATFORM_SHARED_DIR')
+
+
+class Channel(object):
+    def __init__(self, name, directory=SHARED_DIR):
+        self.path = os.path.join(directory, f'{name}.channel') if directory else None
+        self._lock = threading.Lock()
+        # How far this process has read, reset in forked workers, which
+        # start with caches of their own and skip older messages
+        self._offset = 0
+        self._pid = None
+
+    def publish(self, message):
+        # message is a single line of text
+        if self.path is None:
+            return
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            # One write per message, so concurrent writers don't interleave
+            os.write(fd, message.encode('utf-8') + b'\n')
+        finally:
+            os.close(fd)
+
+    def poll(self):
+        # Messages published since the last poll, including this process's own
+        if self.path is None:
+            return []
+        try:
+            size = os.stat(self.path).st_size
+        except FileNotFoundError:
+            size = 0
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._offset = size
+                return []
+            if size <= self._offset:
+                return []
+            with open(self.path, 'rb') as file:
+                file.seek(self._offset)
+                data = file.read(size - self._offset)
+            # A message still being written is picked up next time
+            complete = data.rfind(b'\n') + 1
+            self._offset += complete
+        return data[:complete].decode('utf-8').splitlines()
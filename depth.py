@@ -0,0 +1,67 @@
+import os
+
+import broadcast
+import downstream
+import serialization
+from downstream import ORDER_MGMT_URL
+from yfinance.cache import TTLCache
+
+# Order books change quickly, so they are only reused for a fraction of a
+# second; order-mgmt can also invalidate a symbol when its book changes
+DEPTH_CACHE_TTL = float(os.getenv('DEPTH_CACHE_TTL', '0.5'))
+DEPTH_CACHE_SIZE = int(os.getenv('DEPTH_CACHE_SIZE', '4096'))
+
+# Cached marker for symbols order-mgmt has no depth for
+_NO_DEPTH = object()
+
+_cache = TTLCache(maxsize=DEPTH_CACHE_SIZE, ttl=DEPTH_CACHE_TTL)
+
+# Invalidations reach the caches of every worker process
+_invalidations = broadcast.Channel('depth')
+_ALL = '*'
+
+
+def _load(symbol):
+    response = downstream.get(f"{ORDER_MGMT_URL}/depth/{symbol}")
+    if response.status_code == 200:
+        return serialization.body(response)
+    return _NO_DEPTH
+
+def _sync():
+    for symbol in _invalidations.poll():
+        _cache.invalidate(None if symbol == _ALL else symbol)
+
+def fetch(symbol):
+    # Depth for symbol, or None if order-mgmt has none. Concurrent misses for
+    # the same symbol share one request.
+    _sync()
+    book = _cache.load(symbol, lambda: _load(symbol))
+    return None if book is _NO_DEPTH else book
+
+def cached(symbol):
+    # (found, depth) without fetching, for callers doing their own I/O
+    _sync()
+    book = _cache.get(symbol)
+    if book is None:
+        return False, None
+    return True, None if book is _NO_DEPTH else book
+
+def store(symbol, book, everywhere=False):
+    # Cache depth fetched elsewhere, or pushed by order-mgmt; None means the
+    # symbol has no depth. everywhere=True drops the older book from the
+    # other workers, which fetch the new one on next use.
+    if everywhere:
+        _invalidations.publish(symbol)
+        # Consume our own message before storing, so it doesn't drop the book
+        _sync()
+    _cache.put(symbol, _NO_DEPTH if book is None else book)
+    return book
+
+def invalidate(symbol=None, everywhere=True):
+    # In every worker unless everywhere=False
+    _cache.invalidate(symbol)
+    if everywhere:
+        _invalidations.publish(_ALL if symbol is None else symbol)
+
+def stats():
+    return _cache.stats()
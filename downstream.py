@@ -0,0 +1,222 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+from breaker import CircuitBreaker, CircuitOpen
+
+# Base URLs of the services this platform talks to
+AUTH_URL = os.getenv('AUTH_URL', 'http://auth:5000')
+ORDER_MGMT_URL = os.getenv('ORDER_MGMT_URL', 'http://order-mgmt:5000')
+PORTFOLIO_MGMT_URL = os.getenv('PORTFOLIO_MGMT_URL', 'http://portfolio-mgmt:5000')
+
+# Names the services are reported under in metrics; other hosts by hostname
+SERVICES = {
+    urlsplit(AUTH_URL).hostname: 'auth',
+    urlsplit(ORDER_MGMT_URL).hostname: 'order-mgmt',
+    urlsplit(PORTFOLIO_MGMT_URL).hostname: 'portfolio-mgmt',
+    urlsplit(os.getenv('YFINANCE_BASE_URL', 'https://finance.yahoo.com')).hostname: 'yahoo',
+    urlsplit(os.getenv('YFINANCE_CHART_URL', 'https://query1.finance.yahoo.com')).hostname: 'yahoo',
+}
+
+# Defaults for every host. Each one can be overridden per host with an
+# environment variable suffixed by the host name, e.g.
+# DOWNSTREAM_POOL_SIZE_ORDER_MGMT=50 or DOWNSTREAM_READ_TIMEOUT_FINANCE_YAHOO_COM=10
+DEFAULTS = {
+    'POOL_SIZE': int(os.getenv('DOWNSTREAM_POOL_SIZE', '20')),
+    'CONNECT_TIMEOUT': float(os.getenv('DOWNSTREAM_CONNECT_TIMEOUT', '2')),
+    'READ_TIMEOUT': float(os.getenv('DOWNSTREAM_READ_TIMEOUT', '5')),
+    'RETRIES': int(os.getenv('DOWNSTREAM_RETRIES', '2')),
+    'BACKOFF': float(os.getenv('DOWNSTREAM_BACKOFF', '0.1')),
+    # Circuit breaker: open once this fraction of at least MIN_CALLS calls in
+    # the last WINDOW seconds failed, probe again after OPEN_SECONDS
+    'BREAKER_FAILURE_RATE': float(os.getenv('DOWNSTREAM_BREAKER_FAILURE_RATE', '0.5')),
+    'BREAKER_MIN_CALLS': int(os.getenv('DOWNSTREAM_BREAKER_MIN_CALLS', '20')),
+    'BREAKER_WINDOW': float(os.getenv('DOWNSTREAM_BREAKER_WINDOW', '10')),
+    'BREAKER_OPEN_SECONDS': float(os.getenv('DOWNSTREAM_BREAKER_OPEN_SECONDS', '5')),
+    'BREAKER_PROBES': int(os.getenv('DOWNSTREAM_BREAKER_PROBES', '1')),
+}
+
+# Threads available for issuing downstream calls concurrently
+WORKERS = int(os.getenv('DOWNSTREAM_WORKERS', '32'))
+
+# Calls in flight across all hosts (0 = unlimited). A call waits at most
+# DOWNSTREAM_ADMISSION_WAIT seconds for a slot before being refused.
+MAX_IN_FLIGHT = int(os.getenv('DOWNSTREAM_MAX_IN_FLIGHT', '256'))
+ADMISSION_WAIT = float(os.getenv('DOWNSTREAM_ADMISSION_WAIT', '0.05'))
+
+# Only idempotent requests (GET, PUT, DELETE, ...) are retried, and only on
+# connection errors, read errors or these gateway statuses.
+RETRY_STATUSES = (502, 503, 504)
+
+_sessions = {}
+_breakers = {}
+_overrides = {}
+_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+_slots = threading.BoundedSemaphore(MAX_IN_FLIGHT) if MAX_IN_FLIGHT > 0 else None
+
+
+class Saturated(requests.exceptions.RequestException):
+    # Raised instead of calling a host while MAX_IN_FLIGHT calls are running
+    def __init__(self, retry_after=1.0):
+        super().__init__(f"{MAX_IN_FLIGHT} downstream calls already in flight.")
+        self.retry_after = retry_after
+
+def admit(blocking=True):
+    # Take an in-flight slot, released with release(); raises Saturated if
+    # none frees up in time
+    if _slots is not None and not _slots.acquire(timeout=ADMISSION_WAIT if blocking else None, blocking=blocking):
+        raise Saturated()
+
+def release():
+    if _slots is not None:
+        _slots.release()
+
+
+def _host_key(host):
+    return re.sub(r'[^A-Za-z0-9]', '_', host).upper()
+
+def settings(host):
+    values = {}
+    for name, default in DEFAULTS.items():
+        value = os.getenv(f'DOWNSTREAM_{name}_{_host_key(host)}')
+        values[name] = type(default)(value) if value is not None else default
+    values.update(_overrides.get(host, {}))
+    return values
+
+def configure(host, **overrides):
+    # Override settings for one host (e.g. configure('auth', POOL_SIZE=5)).
+    # Takes effect for sessions created afterwards.
+    with _lock:
+        _overrides.setdefault(host, {}).update(overrides)
+        _sessions.pop(host, None)
+        _breakers.pop(host, None)
+
+def _new_session(host):
+    options = settings(host)
+    retry = Retry(total=options['RETRIES'],
+                  backoff_factor=options['BACKOFF'],
+                  status_forcelist=RETRY_STATUSES,
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=1,
+                          pool_maxsize=options['POOL_SIZE'],
+                          max_retries=retry,
+                          pool_block=False)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.timeout = (options['CONNECT_TIMEOUT'], options['READ_TIMEOUT'])
+    return session
+
+def session(url):
+    host = urlsplit(url).hostname
+    with _lock:
+        s = _sessions.get(host)
+        if s is None:
+            s = _new_session(host)
+            _sessions[host] = s
+        return s
+
+def breaker(host):
+    with _lock:
+        b = _breakers.get(host)
+        if b is None:
+            options = settings(host)
+            b = _breakers[host] = CircuitBreaker(host,
+                                                 failure_rate=options['BREAKER_FAILURE_RATE'],
+                                                 min_calls=options['BREAKER_MIN_CALLS'],
+                                                 window=options['BREAKER_WINDOW'],
+                                                 open_for=options['BREAKER_OPEN_SECONDS'],
+                                                 probes=options['BREAKER_PROBES'])
+        return b
+
+def breakers():
+    # Breaker state per service, for monitoring
+    with _lock:
+        items = list(_breakers.items())
+    return {SERVICES.get(host, host): b.stats() for host, b in items}
+
+_BREAKER_STATES = {'closed': 0, 'half-open': 1, 'open': 2}
+
+metrics.Callback('platform_downstream_breaker_state', 'Circuit breaker state: 0 closed, 1 half-open, 2 open.',
+                 'gauge', ('service',), lambda: [((service,), _BREAKER_STATES[stats['state']]) for service, stats in breakers().items()],
+                 aggregate='max')
+metrics.Callback('platform_downstream_breaker_rejected_total', 'Calls refused by an open circuit breaker.',
+                 'counter', ('service',), lambda: [((service,), stats['rejected']) for service, stats in breakers().items()])
+
+def request(method, url, **kwargs):
+    # Raises CircuitOpen without calling the host while its breaker is open
+    s = session(url)
+    kwargs.setdefault('timeout', s.timeout)
+    host = urlsplit(url).hostname
+    service = SERVICES.get(host, host)
+    b = breaker(host)
+    try:
+        admit()
+    except Saturated:
+        metrics.DOWNSTREAM_ERRORS.inc(service, 'Saturated')
+        raise
+    try:
+        b.before()
+    except CircuitOpen:
+        release()
+        metrics.DOWNSTREAM_ERRORS.inc(service, 'CircuitOpen')
+        raise
+
+    metrics.DOWNSTREAM_IN_FLIGHT.inc(service)
+    started = time.perf_counter()
+    try:
+        response = s.request(method, url, **kwargs)
+    except requests.exceptions.RequestException as e:
+        b.record(False)
+        metrics.DOWNSTREAM_ERRORS.inc(service, type(e).__name__)
+        metrics.DOWNSTREAM_LATENCY.observe(time.perf_counter() - started, service, method, 'error')
+        raise
+    finally:
+        release()
+        metrics.DOWNSTREAM_IN_FLIGHT.dec(service)
+    b.record(response.status_code < 500)
+    metrics.DOWNSTREAM_LATENCY.observe(time.perf_counter() - started, service, method, str(response.status_code))
+    if response.status_code >= 500:
+        metrics.DOWNSTREAM_ERRORS.inc(service, str(response.status_code))
+    return response
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
+
+def put(url, **kwargs):
+    return request('PUT', url, **kwargs)
+
+def delete(url, **kwargs):
+    return request('DELETE', url, **kwargs)
+
+def executor():
+    # Shared pool for running independent downstream calls concurrently
+    global _executor, _executor_pid
+    with _lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='downstream')
+            _executor_pid = os.getpid()
+        return _executor
+
+def reset():
+    # Close every pooled connection; sessions are recreated on next use
+    global _executor
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+        _executor = None
+    for s in sessions:
+        s.close()
@@ -0,0 +1,97 @@
+# Production server settings: python -m gunicorn -c gunicorn.conf.py app:app
+#
+# Several worker processes, each serving requests from a pool of threads.
+# Everything below can be overridden from the environment.
+#
+# Workers share state through PLATFORM_SHARED_DIR, a directory created here
+# unless given: token and depth invalidations reach every worker, /metrics
+# reports the totals of all workers, and settlement (SETTLEMENT_DIR) locks
+# and deduplicates across them. Everything else stays per worker:
+# - quote, portfolio and verification caches, so a symbol is fetched up to
+#   once per worker;
+# - the quote refresher, so Yahoo! is polled for the QUOTE_REFRESH_TOP
+#   symbols by every worker; lower it, or QUOTE_REFRESH_INTERVAL, with more
+#   workers;
+# - circuit breakers (GET /breakers shows the answering worker's) and rate
+#   limits, which allow each client RATE_LIMIT_<NAME> requests per second
+#   per worker.
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+_shared_dir_created = 'PLATFORM_SHARED_DIR' not in os.environ
+if _shared_dir_created:
+    # Set before the app is imported, in the master, so every worker inherits it
+    os.environ['PLATFORM_SHARED_DIR'] = tempfile.mkdtemp(prefix='platform-')
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', str(multiprocessing.cpu_count() * 2 + 1)))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+# Pending connections beyond what the workers are handling
+backlog = int(os.getenv('GUNICORN_BACKLOG', '2048'))
+
+# Seconds an idle keep-alive connection is held open, and how long workers
+# get to finish in-flight requests on shutdown or reload
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+# Workers silent for longer than this are restarted
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+
+# Restart workers after this many requests (0 = never), staggered by jitter
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '0'))
+
+# Import the app once in the master so workers share its memory; everything
+# holding sockets, threads or cached state is reset in post_fork
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def post_fork(server, worker):
+    # Connections opened by the master must never be shared between workers,
+    # so each worker starts with empty pools and caches of its own. Executors
+    # and background threads are recreated on first use in the new process.
+    import depth
+    import downstream
+    import metrics
+    import portfolios
+    import tokens
+    import yfinance
+
+    downstream.reset()
+    yfinance.clearQuoteCache()
+    depth.invalidate(everywhere=False)
+    portfolios.invalidate()
+    tokens.invalidate(everywhere=False)
+    metrics.start()
+    server.log.info("Worker %s started with fresh connection pools and caches.", worker.pid)
+
+
+def post_worker_init(worker):
+    # Runs once the worker has loaded the app, before it accepts connections
+    import warmup
+
+    warmup.run()
+
+
+def worker_exit(server, worker):
+    # Last values of the worker, for the archive kept by child_exit
+    import metrics
+
+    metrics.write()
+
+
+def child_exit(server, worker):
+    import metrics
+
+    metrics.retire(worker.pid)
+
+
+def on_exit(server):
+    if _shared_dir_created:
+        shutil.rmtree(os.environ['PLATFORM_SHARED_DIR'], ignore_errors=True)
@@ -0,0 +1,120 @@
+# Logging setup. Request threads only put records on a bounded queue; a
+# background thread formats and writes them. Messages use %-style arguments,
+# so nothing is formatted for records below LOG_LEVEL, and lines marked with
+# extra=SAMPLED are kept for just a LOG_SAMPLE_RATE fraction of requests.
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from logging.config import dictConfig
+
+import metrics
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# 'text', or 'json' for one JSON object per line
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+# Records waiting to be written; further records are dropped and counted
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# Fraction of high-volume INFO lines that are kept (1 = all of them)
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1'))
+
+# Pass as extra= to mark a line that can be sampled
+SAMPLED = {'sampled': True}
+
+TEXT_FORMAT = '[%(asctime)s] %(levelname)s: %(message)s'
+
+RECORDS_DROPPED = metrics.Counter('platform_log_records_dropped_total', 'Log records dropped because the log queue was full.')
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SampleFilter(logging.Filter):
+    def __init__(self, rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1 or not getattr(record, 'sampled', False):
+            return True
+        return random.random() < self.rate
+
+
+class BackgroundHandler(logging.handlers.QueueHandler):
+    # Hands records to a QueueListener thread writing to the given handlers.
+    # The thread is started on first use in each process, so forked workers
+    # get their own queue and writer.
+    def __init__(self, handlers, maxsize=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize))
+        self.handlers = handlers
+        self.maxsize = maxsize
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensureStarted(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                self.queue = queue.Queue(self.maxsize)
+            self._listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        # The writer thread formats the record; QueueHandler would do it here
+        return record
+
+    def enqueue(self, record):
+        self._ensureStarted()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            RECORDS_DROPPED.inc()
+
+    def close(self):
+        # Write out whatever is still queued
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+        super().close()
+
+
+def configure():
+    formatter = JsonFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT)
+    writer = logging.StreamHandler(sys.stderr)
+    writer.setFormatter(formatter)
+
+    dictConfig({
+        'version': 1,
+        # Modules imported before this call already hold their loggers
+        'disable_existing_loggers': False,
+        'filters': {'sample': {'()': SampleFilter}},
+        'handlers': {'background': {
+            '()': BackgroundHandler,
+            'handlers': [writer],
+            'filters': ['sample'],
+        }},
+        'root': {
+            'level': LOG_LEVEL,
+            'handlers': ['background']
+        }
+    })
@@ -0,0 +1,273 @@
+# Minimal Prometheus instrumentation. Metrics are plain in-process counters
+# guarded by a lock each, cheap enough to leave on for every request, and are
+# rendered in the Prometheus text exposition format by render().
+#
+# With several worker processes (PLATFORM_SHARED_DIR, set by gunicorn.conf.py)
+# every worker also writes its values to a file there, at least once per
+# METRICS_WRITE_INTERVAL seconds, and render() reports the total over all of
+# them, so a scrape sees the same series whichever worker answers it. The
+# counters of workers that exited are kept in an archive, so totals never
+# go backwards.
+import bisect
+import contextlib
+import fcntl
+import json
+import os
+import threading
+import time
+
+SHARED_DIR = os.getenv('PLATFORM_SHARED_DIR')
+WRITE_INTERVAL = float(os.getenv('METRICS_WRITE_INTERVAL', '1'))
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(object):
+    type = None
+    # How the values of several processes are combined: 'sum' or 'max'
+    aggregate = 'sum'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def _header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def collect(self):
+        # [(labelvalues, value)]
+        with self._lock:
+            return list(self._values.items())
+
+    def render(self, items):
+        return self._header() + [f'{self.name}{_labels(self.labelnames, key)} {_number(value)}' for key, value in items]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, *labelvalues, value):
+        with self._lock:
+            self._values[labelvalues] = value
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labelvalues)
+            if series is None:
+                # Per-bucket counts (last one is +Inf), then sum
+                series = self._values[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def collect(self):
+        with self._lock:
+            return [(key, list(series)) for key, series in self._values.items()]
+
+    def render(self, items):
+        lines = self._header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, ("le", _number(bound)))} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_number(series[-1])}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class Callback(Counter):
+    # Values read at scrape time from fn(), which returns a list of
+    # (labelvalues, value); for state kept elsewhere such as cache statistics
+    def __init__(self, name, help, type, labelnames, fn, aggregate='sum'):
+        super().__init__(name, help, labelnames)
+        self.type = type
+        self.aggregate = aggregate
+        self._fn = fn
+
+    def collect(self):
+        return [(tuple(key), value) for key, value in self._fn()]
+
+
+def _collect():
+    return {metric.name: metric.collect() for metric in list(_registry)}
+
+def _combine(type, aggregate, values, items):
+    # Fold items of a metric into its {labelvalues: value}
+    for key, value in items:
+        key = tuple(key)
+        current = values.get(key)
+        if current is None:
+            values[key] = value
+        elif type == 'histogram':
+            values[key] = [a + b for a, b in zip(current, value)]
+        elif aggregate == 'max':
+            values[key] = max(current, value)
+        else:
+            values[key] = current + value
+
+def _snapshot(metrics):
+    # {name: {'type', 'aggregate', 'values'}} as written to the shared directory,
+    # from [(name, type, aggregate, [(labelvalues, value)])]
+    return {name: {'type': type, 'aggregate': aggregate, 'values': [[list(key), value] for key, value in items]}
+            for name, type, aggregate, items in metrics}
+
+def _dump(path, snapshot):
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(snapshot, file)
+    os.replace(f'{path}.tmp', path)
+
+def _load(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+@contextlib.contextmanager
+def _shared(operation):
+    directory = os.path.join(SHARED_DIR, 'metrics')
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        fcntl.flock(lock, operation)
+        yield directory
+
+def write():
+    # Publish this process's values to the other workers
+    if SHARED_DIR is None:
+        return
+    collected = _collect()
+    snapshot = _snapshot((metric.name, metric.type, metric.aggregate, collected[metric.name]) for metric in list(_registry))
+    with _shared(fcntl.LOCK_SH) as directory:
+        _dump(os.path.join(directory, f'{os.getpid()}.json'), snapshot)
+
+def _write_periodically():
+    while True:
+        time.sleep(WRITE_INTERVAL)
+        try:
+            write()
+        except OSError:
+            pass
+
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+def start():
+    # Start writing this process's values in the background; called in
+    # every worker process
+    global _writer_pid
+    if SHARED_DIR is None:
+        return
+    with _writer_lock:
+        if _writer_pid == os.getpid():
+            return
+        _writer_pid = os.getpid()
+    threading.Thread(target=_write_periodically, name='metrics-writer', daemon=True).start()
+
+def retire(pid):
+    # Move the counters and histograms of a worker that exited into the
+    # archive and drop its gauges; called by the server for each such worker
+    if SHARED_DIR is None:
+        return
+    with _shared(fcntl.LOCK_EX) as directory:
+        path = os.path.join(directory, f'{pid}.json')
+        snapshot = _load(path)
+        if not snapshot:
+            return
+        archive_path = os.path.join(directory, 'archive.json')
+        archive = {}
+        for snapshot in (_load(archive_path), snapshot):
+            for name, metric in snapshot.items():
+                if metric['type'] not in ('counter', 'histogram'):
+                    continue
+                values = archive.setdefault(name, (metric['type'], metric['aggregate'], {}))[2]
+                _combine(metric['type'], metric['aggregate'], values, metric['values'])
+        _dump(archive_path, _snapshot((name, type, aggregate, values.items()) for name, (type, aggregate, values) in archive.items()))
+        os.remove(path)
+
+def render():
+    if SHARED_DIR is None:
+        collected = _collect()
+    else:
+        write()
+        # Every worker's file, this one's included, and the archive
+        with _shared(fcntl.LOCK_SH) as directory:
+            snapshots = [_load(os.path.join(directory, name)) for name in os.listdir(directory) if name.endswith('.json')]
+        combined = {metric.name: {} for metric in _registry}
+        for snapshot in snapshots:
+            for name, metric in snapshot.items():
+                if name in combined:
+                    _combine(metric['type'], metric['aggregate'], combined[name], metric['values'])
+        collected = {name: list(values.items()) for name, values in combined.items()}
+
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.render(collected[metric.name]))
+    return '\n'.join(lines) + '\n'
+
+
+# Incoming requests
+REQUEST_LATENCY = Histogram('platform_request_duration_seconds', 'Time spent serving requests.', ('route', 'method', 'status'))
+REQUESTS_IN_FLIGHT = Gauge('platform_requests_in_flight', 'Requests currently being served.')
+REQUEST_ERRORS = Counter('platform_request_errors_total', 'Requests answered with a 5xx status.', ('route', 'method', 'status'))
+
+# Calls to auth, order-mgmt, portfolio-mgmt and Yahoo! Finance
+DOWNSTREAM_LATENCY = Histogram('platform_downstream_duration_seconds', 'Time spent in downstream calls.', ('service', 'method', 'status'))
+DOWNSTREAM_IN_FLIGHT = Gauge('platform_downstream_in_flight', 'Downstream calls in progress.', ('service',))
+DOWNSTREAM_ERRORS = Counter('platform_downstream_errors_total', 'Downstream calls that failed or returned a 5xx status.', ('service', 'error'))
+
+QUOTE_PARSE_LATENCY = Histogram('platform_quote_parse_duration_seconds', 'Time spent extracting quotes from Yahoo! Finance pages.',
+                                buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+
+def cache_stats(caches):
+    # Expose the statistics of the given {name: stats_fn} caches
+    def read(field):
+        return lambda: [((name,), stats()[field]) for name, stats in caches.items()]
+    Callback('platform_cache_hits_total', 'Cache hits.', 'counter', ('cache',), read('hits'))
+    Callback('platform_cache_misses_total', 'Cache misses.', 'counter', ('cache',), read('misses'))
+    Callback('platform_cache_evictions_total', 'Entries evicted to stay within the size bound.', 'counter', ('cache',), read('evictions'))
+    Callback('platform_cache_coalesced_total', 'Misses that waited for a fetch already in progress.', 'counter', ('cache',), read('coalesced'))
+    Callback('platform_cache_entries', 'Entries currently cached.', 'gauge', ('cache',), read('size'))
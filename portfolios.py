@@ -0,0 +1,70 @@
+import os
+
+import downstream
+import serialization
+from downstream import PORTFOLIO_MGMT_URL
+from yfinance.cache import TTLCache
+
+# Portfolios read through this module are reused for PORTFOLIO_CACHE_TTL
+# seconds; updates made through it are written to the cache as well
+PORTFOLIO_CACHE_TTL = float(os.getenv('PORTFOLIO_CACHE_TTL', '2'))
+PORTFOLIO_CACHE_SIZE = int(os.getenv('PORTFOLIO_CACHE_SIZE', '10000'))
+
+_cache = TTLCache(maxsize=PORTFOLIO_CACHE_SIZE, ttl=PORTFOLIO_CACHE_TTL)
+
+
+class PortfolioUnavailable(Exception):
+    def __init__(self, client_id, status):
+        super().__init__(f"Portfolio for {client_id} could not be fetched.")
+        self.status = status
+
+
+def _load(client_id):
+    response = downstream.get(f"{PORTFOLIO_MGMT_URL}/portfolio/{client_id}")
+    if response.status_code != 200:
+        raise PortfolioUnavailable(client_id, response.status_code)
+    return serialization.body(response)
+
+def fetch(client_id, fresh=False):
+    # Returns (portfolio, status_code); portfolio is None unless the status is
+    # 200. fresh=True skips the cache, for checks that must see the latest
+    # state (e.g. right before an order is sent), and refreshes it.
+    try:
+        if fresh:
+            portfolio = _load(client_id)
+            _cache.put(client_id, portfolio)
+        else:
+            portfolio = _cache.load(client_id, lambda: _load(client_id))
+    except PortfolioUnavailable as e:
+        return None, e.status
+    return dict(portfolio), 200
+
+def cached(client_id):
+    # Portfolio if cached, without fetching it, for callers doing their own I/O
+    portfolio = _cache.get(client_id)
+    return dict(portfolio) if portfolio is not None else None
+
+def store(client_id, portfolio):
+    # Cache a portfolio fetched elsewhere
+    _cache.put(client_id, portfolio)
+    return portfolio
+
+def update(client_id, payload, headers=None):
+    # PUT payload to the client's portfolio and keep the cache in step
+    try:
+        response = downstream.put(f"{PORTFOLIO_MGMT_URL}/portfolio/{client_id}", json=payload, headers=headers)
+    except Exception:
+        _cache.invalidate(client_id)
+        raise
+    cached = _cache.peek(client_id)
+    if response.status_code == 200 and cached is not None:
+        _cache.put(client_id, dict(cached, **payload))
+    else:
+        _cache.invalidate(client_id)
+    return response
+
+def invalidate(client_id=None):
+    _cache.invalidate(client_id)
+
+def stats():
+    return _cache.stats()
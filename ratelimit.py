@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Reverse proxies in front of the app whose X-Forwarded-For entries can be
+# trusted. Anonymous clients are then keyed by the address the outermost of
+# them saw instead of the connecting address, which is always a proxy's.
+TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', '0'))
+
+
+class RateLimited(Exception):
+    def __init__(self, budget, key, retry_after):
+        super().__init__(f"{key} is over the {budget} rate limit.")
+        self.budget = budget
+        self.retry_after = retry_after
+
+
+class RateLimiter(object):
+    # A token bucket per key: up to `burst` requests at once, refilled at
+    # `rate` requests per second. Buckets of the least recently seen keys
+    # are dropped beyond max_keys, which only ever resets them to full.
+    def __init__(self, rate, burst, max_keys=100000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> [tokens, last refill]
+        self._buckets = OrderedDict()
+
+        self.admitted = 0
+        self.limited = 0
+
+    def acquire(self, key, cost=1):
+        # 0 if the request may go ahead, otherwise the seconds until it could.
+        # A cost above burst is let through once the bucket is full and
+        # leaves it in debt, which later requests wait out.
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = self._clock()
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+            needed = min(cost, self.burst)
+            if bucket[0] >= needed:
+                bucket[0] -= cost
+                self.admitted += 1
+                return 0.0
+            self.limited += 1
+            return (needed - bucket[0]) / self.rate
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'keys': len(self._buckets),
+                'admitted': self.admitted,
+                'limited': self.limited,
+            }
+
+
+def client_address(remote_addr, forwarded_for=None):
+    # Address to key an anonymous client's budget by
+    if TRUSTED_PROXIES and forwarded_for:
+        addresses = [address.strip() for address in forwarded_for.split(',')]
+        if len(addresses) >= TRUSTED_PROXIES:
+            return addresses[-TRUSTED_PROXIES]
+    return remote_addr
+
+def from_env(name, rate, burst):
+    # RATE_LIMIT_<NAME> requests per second per client (0 = unlimited), in
+    # bursts of up to RATE_LIMIT_<NAME>_BURST
+    name = name.upper()
+    return RateLimiter(float(os.getenv(f'RATE_LIMIT_{name}', str(rate))),
+                       float(os.getenv(f'RATE_LIMIT_{name}_BURST', str(burst))),
+                       max_keys=int(os.getenv('RATE_LIMIT_CLIENTS', '100000')))
@@ -0,0 +1,39 @@
+# JSON encoding and decoding for request handlers and downstream bodies.
+# Uses orjson when it is installed, the standard library otherwise; either
+# way dumps() returns bytes ready to be sent.
+import json
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    # Non-string keys and NumPy values are encoded like the stdlib would
+    _OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(content):
+        return orjson.dumps(content, option=_OPTIONS)
+
+    loads = orjson.loads
+else:
+    def dumps(content):
+        return json.dumps(content).encode('utf-8')
+
+    loads = json.loads
+
+
+def body(response):
+    # Decoded JSON body of a downstream response
+    return loads(response.content)
+
+
+class FlaskJSONProvider(JSONProvider):
+    # Lets request.get_json() and jsonify() use the same encoder
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return loads(s)
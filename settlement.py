@@ -0,0 +1,252 @@
+import fcntl
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+import downstream
+import portfolios
+
+logger = logging.getLogger(__name__)
+
+# Settled fill ids and the per-client settlement locks are kept under
+# SETTLEMENT_DIR, shared by every worker process on the host. Replicas on
+# other hosts need a directory of their own and rely on portfolio-mgmt
+# honouring the Idempotency-Key header instead.
+SETTLEMENT_DIR = os.getenv('SETTLEMENT_DIR', os.path.join(tempfile.gettempdir(), 'platform-settlement'))
+# How long settled fill ids are remembered to recognise replays
+SETTLED_KEYS_TTL = float(os.getenv('SETTLEMENT_KEYS_TTL', '86400'))
+# Clients are locked by stripe, one lock file each; clients sharing a stripe
+# only wait for each other
+LOCK_STRIPES = int(os.getenv('SETTLEMENT_LOCK_STRIPES', '256'))
+
+
+class SecretFile(object):
+    # Contents of a secret file, read once and re-read only when the file
+    # changes on disk
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._value = None
+
+    def read(self):
+        if not self.path:
+            return None
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        with self._lock:
+            if stamp != self._stamp:
+                with open(self.path) as file:
+                    self._value = file.read()
+                self._stamp = stamp
+            return self._value
+
+
+class SettlementError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def deltas(fill):
+    # Changes a fill makes to each involved portfolio, as
+    # {client_id: {'Cash': amount, symbol: quantity}}
+    symbol = fill['symbol']
+    quantity = int(fill['quantity'])
+    paid_amount = float(fill['price']) * quantity
+    # A buy moves shares to the client and cash to the counterparty, a sell
+    # the other way around
+    sign = 1 if fill['type'] == 'B' else -1
+
+    changes = {fill['client_id']: {'Cash': -sign * paid_amount, symbol: sign * quantity}}
+    from_client_id = fill['from_client_id']
+    if from_client_id != 'external':
+        changes.setdefault(from_client_id, {'Cash': 0.0, symbol: 0})
+        changes[from_client_id]['Cash'] += sign * paid_amount
+        changes[from_client_id][symbol] = changes[from_client_id].get(symbol, 0) - sign * quantity
+    return changes
+
+
+class Ledger(object):
+    # Fill ids settled in the last ttl seconds, in a SQLite database, and
+    # locks on clients, as flocks on lock files. Both hold across every
+    # process using the same directory.
+    def __init__(self, directory, ttl=SETTLED_KEYS_TTL, stripes=LOCK_STRIPES):
+        self.directory = directory
+        self.ttl = ttl
+        self.stripes = stripes
+        self._lock = threading.Lock()
+        self._pid = None
+        self._db = None
+
+    def _open(self):
+        # Must be called with the lock held. Reopened in forked workers.
+        if self._pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(self.directory, 'settled.db'), timeout=30,
+                                       isolation_level=None, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS settled (fill_id TEXT PRIMARY KEY, settled_at REAL NOT NULL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS settled_at ON settled (settled_at)')
+            os.makedirs(os.path.join(self.directory, 'locks'), exist_ok=True)
+            self._pid = os.getpid()
+        return self._db
+
+    @contextmanager
+    def locked(self, client_ids):
+        # Always acquired in stripe order so concurrent settlements can't deadlock
+        stripes = sorted({int(hashlib.sha256(str(client_id).encode('utf-8')).hexdigest(), 16) % self.stripes
+                          for client_id in client_ids})
+        with self._lock:
+            self._open()
+        # Each flock is taken on a file opened for it, so that it excludes
+        # other threads of this process as well
+        held = []
+        try:
+            for stripe in stripes:
+                held.append(open(os.path.join(self.directory, 'locks', str(stripe)), 'w'))
+                fcntl.flock(held[-1], fcntl.LOCK_EX)
+            yield
+        finally:
+            for lock in reversed(held):
+                lock.close()
+
+    def settled(self, fill_ids):
+        # Those of fill_ids that were already settled
+        found = set()
+        since = time.time() - self.ttl
+        with self._lock:
+            db = self._open()
+            for i in range(0, len(fill_ids), 500):
+                chunk = fill_ids[i:i + 500]
+                rows = db.execute(f"SELECT fill_id FROM settled WHERE settled_at > ? AND fill_id IN ({','.join('?' * len(chunk))})",
+                                  [since] + chunk)
+                found.update(fill_id for fill_id, in rows)
+        return found
+
+    def record(self, fill_ids):
+        now = time.time()
+        with self._lock:
+            db = self._open()
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                db.executemany('INSERT OR REPLACE INTO settled VALUES (?, ?)', [(fill_id, now) for fill_id in fill_ids])
+                db.execute('DELETE FROM settled WHERE settled_at <= ?', (now - self.ttl,))
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+
+
+class SettlementEngine(object):
+    # Fills are checked for replays, applied and recorded while their
+    # clients are locked, so a fill replayed to another worker is skipped
+    # there as well
+    def __init__(self, directory=SETTLEMENT_DIR):
+        self._ledger = Ledger(directory)
+
+    def _fetch(self, client_id):
+        # Settlement computes new balances, so it never works from the cache
+        portfolio, status = portfolios.fetch(client_id, fresh=True)
+        if portfolio is None:
+            raise SettlementError(f"Portfolio for {client_id} could not be fetched.", status)
+        return portfolio
+
+    def _put(self, client_id, payload, key):
+        headers = {'Idempotency-Key': key} if key else None
+        try:
+            response = portfolios.update(client_id, payload, headers=headers)
+        except requests.exceptions.RequestException as e:
+            logger.error("Portfolio for %s could not be updated: %s", client_id, e)
+            return 503
+        if response.status_code != 200:
+            logger.error("Portfolio for %s could not be updated.", client_id)
+        return response.status_code
+
+    def settle(self, fills, key=None):
+        # Apply a batch of fills as one unit: every involved portfolio is
+        # fetched once, the net change per client is computed, and all
+        # portfolios are updated concurrently. If any update fails, the ones
+        # that succeeded are put back. Fills carrying a fill_id that was
+        # already settled are skipped. Returns (settled, duplicates).
+        changes = [deltas(fill) for fill in fills]
+        client_ids = set()
+        for change in changes:
+            client_ids.update(change)
+
+        with self._ledger.locked(client_ids):
+            return self._settle(fills, changes, key)
+
+    def _settle(self, fills, changes, key):
+        settled = self._ledger.settled([str(fill['fill_id']) for fill in fills if fill.get('fill_id') is not None])
+        net = {}
+        fill_ids = []
+        duplicates = 0
+        for fill, change in zip(fills, changes):
+            fill_id = fill.get('fill_id')
+            if fill_id is not None:
+                fill_id = str(fill_id)
+                if fill_id in settled or fill_id in fill_ids:
+                    duplicates += 1
+                    continue
+                fill_ids.append(fill_id)
+            for client_id, amounts in change.items():
+                totals = net.setdefault(client_id, {})
+                for name, amount in amounts.items():
+                    totals[name] = totals.get(name, 0) + amount
+
+        if not net:
+            return 0, duplicates
+
+        executor = downstream.executor()
+        client_ids = list(net)
+        portfolios = dict(zip(client_ids, executor.map(self._fetch, client_ids)))
+
+        originals = {}
+        updates = {}
+        for client_id, totals in net.items():
+            portfolio = portfolios[client_id]
+            originals[client_id] = {}
+            updates[client_id] = {}
+            for name, amount in totals.items():
+                if name == 'Cash':
+                    old = float(portfolio['Cash'])
+                else:
+                    old = int(portfolio[name]) if portfolio.get(name) is not None else 0
+                originals[client_id][name] = old
+                updates[client_id][name] = old + amount
+            logger.info("Updating portfolio for %s with: %s.", client_id, updates[client_id])
+
+        if key is None and fill_ids:
+            key = hashlib.sha256(','.join(fill_ids).encode('utf-8')).hexdigest()
+        # One key per portfolio update, so that portfolio-mgmt doesn't take the
+        # counterparty's update, or a compensation, for a replay
+        def update_key(client_id, suffix=''):
+            return f'{key}:{client_id}{suffix}' if key else None
+
+        statuses = dict(zip(client_ids, executor.map(
+            lambda client_id: self._put(client_id, updates[client_id], update_key(client_id)), client_ids)))
+        failed = [client_id for client_id, status in statuses.items() if status != 200]
+        if failed:
+            # Undo the updates that went through so no side is left half-settled
+            applied = [client_id for client_id in client_ids if client_id not in failed]
+            for client_id, status in zip(applied, executor.map(
+                    lambda client_id: self._put(client_id, originals[client_id], update_key(client_id, ':undo')), applied)):
+                if status != 200:
+                    logger.critical("Compensation for %s failed, portfolio left at %s instead of %s.",
+                                    client_id, updates[client_id], originals[client_id])
+            raise SettlementError(f"Portfolios {failed} could not be updated.", statuses[failed[0]])
+
+        if fill_ids:
+            self._ledger.record(fill_ids)
+        return len(fills) - duplicates, duplicates
@@ -0,0 +1,120 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+STREAM_INTERVAL = float(os.getenv('STREAM_INTERVAL', '1'))
+STREAM_WORKERS = int(os.getenv('STREAM_WORKERS', '8'))
+
+
+class Subscription(object):
+    # Updates waiting to be sent to one subscriber. Only the latest update per
+    # symbol is kept, so a slow client skips intermediate prices instead of
+    # falling further and further behind. notify() is called after each
+    # update, for subscribers that don't wait in next(), e.g. on an event loop.
+    def __init__(self, symbols, notify=None):
+        self.symbols = symbols
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._notify = notify
+
+    def publish(self, symbol, snapshot):
+        with self._cond:
+            self._pending[symbol] = snapshot
+            self._cond.notify()
+        if self._notify is not None:
+            self._notify()
+
+    def next(self, timeout):
+        # Pending updates as a list of (symbol, snapshot); empty on timeout
+        with self._cond:
+            if not self._pending:
+                self._cond.wait(timeout)
+            updates, self._pending = self._pending, {}
+        return list(updates.items())
+
+    def take(self):
+        # Pending updates without waiting
+        with self._cond:
+            updates, self._pending = self._pending, {}
+        return list(updates.items())
+
+
+class QuoteHub(object):
+    # Polls each subscribed symbol once per interval, however many clients
+    # subscribe to it, and pushes the snapshot to them when it changed.
+    def __init__(self, fetch, interval=STREAM_INTERVAL, workers=STREAM_WORKERS):
+        self._fetch = fetch
+        self.interval = interval
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._last = {}
+        self._thread = None
+        self._pid = None
+
+    def subscribe(self, symbols, notify=None):
+        subscription = Subscription(symbols, notify)
+        with self._lock:
+            for symbol in symbols:
+                self._subscribers.setdefault(symbol, set()).add(subscription)
+                # New subscribers start from the last known state
+                if symbol in self._last:
+                    subscription.publish(symbol, self._last[symbol])
+        self._ensureStarted()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for symbol in subscription.symbols:
+                subscribers = self._subscribers.get(symbol)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[symbol]
+                    self._last.pop(symbol, None)
+
+    def _ensureStarted(self):
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='quote-hub', daemon=True)
+            self._thread.start()
+
+    def _poll(self, symbol):
+        try:
+            snapshot = self._fetch(symbol)
+        except Exception:
+            logger.exception("Could not poll %s for subscribers.", symbol)
+            return
+        with self._lock:
+            if snapshot is None or self._last.get(symbol) == snapshot:
+                return
+            subscribers = self._subscribers.get(symbol)
+            if not subscribers:
+                return
+            self._last[symbol] = snapshot
+            subscribers = list(subscribers)
+        for subscription in subscribers:
+            subscription.publish(symbol, snapshot)
+
+    def _run(self):
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='quote-hub') as executor:
+            while True:
+                started = time.monotonic()
+                with self._lock:
+                    symbols = list(self._subscribers)
+                list(executor.map(self._poll, symbols))
+                time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'symbols': len(self._subscribers),
+                'subscriptions': len(set().union(*self._subscribers.values())) if self._subscribers else 0,
+            }
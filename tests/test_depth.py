@@ -0,0 +1,34 @@
+import pytest
+
+import broadcast
+import depth
+
+
+@pytest.fixture
+def channels(tmp_path, monkeypatch):
+    # This worker's channel, and the same channel as another worker sees it
+    monkeypatch.setattr(depth, '_invalidations', broadcast.Channel('depth', str(tmp_path)))
+    other = broadcast.Channel('depth', str(tmp_path))
+    depth._sync()
+    other.poll()
+    depth.invalidate(everywhere=False)
+    yield other
+    depth.invalidate(everywhere=False)
+
+
+def test_pushed_book_invalidates_other_workers(channels):
+    depth.store('AAPL', {'bids': [[1.0, 2]]}, everywhere=True)
+    assert channels.poll() == ['AAPL']
+    # The worker it was pushed to keeps it
+    assert depth.cached('AAPL') == (True, {'bids': [[1.0, 2]]})
+
+def test_fetched_book_stays_local(channels):
+    depth.store('AAPL', {'bids': []})
+    depth.store('MSFT', None)
+    assert channels.poll() == []
+    assert depth.cached('MSFT') == (True, None)
+
+def test_invalidation_from_another_worker(channels):
+    depth.store('AAPL', {'bids': []})
+    channels.publish('AAPL')
+    assert depth.cached('AAPL') == (False, None)
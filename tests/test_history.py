@@ -0,0 +1,75 @@
+import time
+
+import numpy as np
+import pytest
+
+from yfinance.history import COLUMNS, HistoryStore, LONGEST
+
+DAY = 86400
+
+
+class FakeChart(object):
+    # A bar at every multiple of the interval, the newest one still open
+    def __init__(self, step=DAY):
+        self.step = step
+        self.calls = []
+        self.fail = False
+
+    def __call__(self, symbol, start, end, interval):
+        self.calls.append((start, end))
+        if self.fail:
+            return None
+        first = -(-start // self.step) * self.step
+        times = np.arange(first, end, self.step, dtype=np.int64)
+        bars = {'time': times}
+        for name, dtype in COLUMNS[1:]:
+            bars[name] = np.full(len(times), float(len(self.calls)), dtype=dtype)
+        return bars
+
+
+@pytest.fixture
+def chart():
+    return FakeChart()
+
+@pytest.fixture
+def store(tmp_path, chart):
+    return HistoryStore(str(tmp_path), chart)
+
+
+def test_newest_bars_are_returned(store):
+    now = int(time.time())
+    bars = store.get('AAPL', now - 10 * DAY)
+    assert bars['time'][-1] == now // DAY * DAY
+    assert list(np.diff(bars['time'])) == [DAY] * (len(bars['time']) - 1)
+
+def test_tail_is_fetched_every_time_but_never_stored(store, chart):
+    now = int(time.time())
+    store.get('AAPL', now - 10 * DAY)
+    store.get('AAPL', now - 10 * DAY)
+    cutoff = chart.calls[0][1]
+    assert cutoff <= now - LONGEST['1d']
+    # The stored range once, the tail on both calls
+    assert [call[0] for call in chart.calls[1:]] == [cutoff, cutoff]
+    assert store._read('AAPL', '1d').meta['ranges'][-1][1] == cutoff
+    assert store._read('AAPL', '1d').columns['time'][-1] < cutoff
+
+def test_tail_reflects_latest_values(store, chart):
+    now = int(time.time())
+    first = store.get('AAPL', now - 10 * DAY)
+    second = store.get('AAPL', now - 10 * DAY)
+    assert first['close'][-1] != second['close'][-1]
+    assert list(first['close'][:-2]) == list(second['close'][:-2])
+
+def test_failed_tail_returns_stored_bars(store, chart):
+    now = int(time.time())
+    store.get('AAPL', now - 10 * DAY)
+    chart.fail = True
+    bars = store.get('AAPL', now - 10 * DAY)
+    assert len(bars['time']) and bars['time'][-1] < now - LONGEST['1d']
+
+def test_range_entirely_recent(store, chart):
+    now = int(time.time())
+    bars = store.get('AAPL', now - 3600, interval='1mo')
+    assert chart.calls == [(now - 3600, chart.calls[0][1])]
+    assert store._read('AAPL', '1mo').meta['ranges'] == []
+    assert all(bars['time'] >= now - 3600)
@@ -0,0 +1,41 @@
+import pytest
+
+import yfinance
+
+
+@pytest.fixture
+def yahoo(monkeypatch):
+    # Quotes for AAPL only, counting requests; tracked symbols are recorded
+    calls = []
+    tracked = []
+    def request(symbol):
+        calls.append(symbol)
+        return {'price': 10.0} if symbol == 'AAPL' else None
+    monkeypatch.setattr(yfinance, 'request', request)
+    monkeypatch.setattr(yfinance._refresher, 'track', tracked.append)
+    yfinance.clearQuoteCache()
+    yield calls, tracked
+    yfinance.clearQuoteCache()
+
+
+def test_known_symbols_are_tracked(yahoo):
+    calls, tracked = yahoo
+    assert yfinance.getQuotes('AAPL') == {'price': 10.0}
+    assert yfinance.getQuotes('AAPL') == {'price': 10.0}
+    assert calls == ['AAPL']
+    assert tracked == ['AAPL', 'AAPL']
+
+def test_unknown_symbols_are_not_tracked_and_briefly_cached(yahoo):
+    calls, tracked = yahoo
+    assert yfinance.getQuotes('NOPE') is None
+    assert yfinance.getQuotes('NOPE') is None
+    assert calls == ['NOPE']
+    assert tracked == []
+    assert yfinance.isUnknown('NOPE')
+
+def test_stored_quote_clears_unknown(yahoo):
+    yfinance.storeQuote('NOPE', None)
+    assert yfinance.isUnknown('NOPE')
+    yfinance.storeQuote('NOPE', {'price': 1.0})
+    assert not yfinance.isUnknown('NOPE')
+    assert yfinance.getQuotes('NOPE') == {'price': 1.0}
@@ -0,0 +1,163 @@
+import threading
+
+import pytest
+
+import settlement
+from settlement import SettlementEngine, SettlementError
+
+
+class FakePortfolios(object):
+    # Stands in for the portfolios module, keeping portfolio-mgmt's state in memory
+    def __init__(self, portfolios):
+        self.portfolios = portfolios
+        self.puts = []
+        self.keys = []
+        self.failing = set()
+        # Answer a repeated Idempotency-Key without applying it, as
+        # portfolio-mgmt may
+        self.honour_keys = False
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def fetch(self, client_id, fresh=False):
+        with self._lock:
+            if client_id not in self.portfolios:
+                return None, 404
+            return dict(self.portfolios[client_id]), 200
+
+    def update(self, client_id, payload, headers=None):
+        with self._lock:
+            self.puts.append((client_id, dict(payload)))
+            key = (headers or {}).get('Idempotency-Key')
+            self.keys.append((client_id, key))
+            if client_id in self.failing:
+                return FakeResponse(500)
+            if self.honour_keys and key is not None:
+                if key in self._seen:
+                    return FakeResponse(200)
+                self._seen.add(key)
+            self.portfolios[client_id].update(payload)
+            return FakeResponse(200)
+
+
+class FakeResponse(object):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+@pytest.fixture
+def service(monkeypatch):
+    fake = FakePortfolios({
+        'alice': {'Cash': 1000.0, 'AAPL': 10},
+        'bob': {'Cash': 500.0, 'AAPL': 2},
+    })
+    monkeypatch.setattr(settlement.portfolios, 'fetch', fake.fetch)
+    monkeypatch.setattr(settlement.portfolios, 'update', fake.update)
+    return fake
+
+
+def fill(fill_id, client_id='alice', type='B', quantity=1, price=10.0, from_client_id='external', symbol='AAPL'):
+    return {'fill_id': fill_id, 'client_id': client_id, 'type': type, 'symbol': symbol,
+            'quantity': quantity, 'price': price, 'from_client_id': from_client_id}
+
+
+def test_fills_are_netted_into_one_update_per_client(service, tmp_path):
+    engine = SettlementEngine(str(tmp_path))
+    fills = [
+        fill('f1', quantity=2, price=10.0, from_client_id='bob'),
+        fill('f2', quantity=3, price=20.0),
+        fill('f3', type='S', quantity=1, price=30.0, from_client_id='bob'),
+    ]
+    assert engine.settle(fills) == (3, 0)
+
+    assert sorted(client_id for client_id, _ in service.puts) == ['alice', 'bob']
+    assert service.portfolios['alice'] == {'Cash': 1000.0 - 20.0 - 60.0 + 30.0, 'AAPL': 10 + 2 + 3 - 1}
+    assert service.portfolios['bob'] == {'Cash': 500.0 + 20.0 - 30.0, 'AAPL': 2 - 2 + 1}
+
+
+def test_duplicate_fills_are_settled_once(service, tmp_path):
+    engine = SettlementEngine(str(tmp_path))
+    assert engine.settle([fill('f1'), fill('f1')]) == (1, 1)
+    assert engine.settle([fill('f1')]) == (0, 1)
+    assert service.portfolios['alice']['AAPL'] == 11
+    assert len(service.puts) == 1
+
+
+def test_duplicate_fills_are_settled_once_across_workers(service, tmp_path):
+    # Every worker process has an engine of its own over the shared directory
+    first, second = SettlementEngine(str(tmp_path)), SettlementEngine(str(tmp_path))
+    assert first.settle([fill('f1')]) == (1, 0)
+    assert second.settle([fill('f1')]) == (0, 1)
+    assert service.portfolios['alice']['AAPL'] == 11
+
+
+def test_concurrent_replays_are_settled_once(service, tmp_path):
+    engines = [SettlementEngine(str(tmp_path)) for _ in range(4)]
+    results = []
+    threads = [threading.Thread(target=lambda engine=engine: results.append(engine.settle([fill('f1', from_client_id='bob')])))
+               for engine in engines for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [(0, 1)] * 15 + [(1, 0)]
+    assert service.portfolios['alice']['AAPL'] == 11
+    assert service.portfolios['bob']['AAPL'] == 1
+
+
+def test_each_update_has_its_own_idempotency_key(service, tmp_path):
+    service.honour_keys = True
+    engine = SettlementEngine(str(tmp_path))
+    engine.settle([fill('f1', quantity=1, from_client_id='bob')])
+
+    # Both sides applied, neither taken for a replay of the other
+    assert service.portfolios['alice'] == {'Cash': 990.0, 'AAPL': 11}
+    assert service.portfolios['bob'] == {'Cash': 510.0, 'AAPL': 1}
+    keys = dict(service.keys)
+    assert keys['alice'] != keys['bob']
+
+    # The same fills sent to another host's engine are recognised by the keys
+    SettlementEngine(str(tmp_path / 'other')).settle([fill('f1', quantity=1, from_client_id='bob')])
+    assert service.portfolios['alice'] == {'Cash': 990.0, 'AAPL': 11}
+    assert service.portfolios['bob'] == {'Cash': 510.0, 'AAPL': 1}
+
+
+def test_failed_update_is_compensated(service, tmp_path):
+    engine = SettlementEngine(str(tmp_path))
+    service.failing.add('bob')
+    with pytest.raises(SettlementError) as error:
+        engine.settle([fill('f1', quantity=2, from_client_id='bob')])
+
+    assert error.value.status == 500
+    assert service.portfolios['alice'] == {'Cash': 1000.0, 'AAPL': 10}
+    assert service.portfolios['bob'] == {'Cash': 500.0, 'AAPL': 2}
+    # alice was updated and then put back
+    assert [payload for client_id, payload in service.puts if client_id == 'alice'] == [
+        {'Cash': 980.0, 'AAPL': 12},
+        {'Cash': 1000.0, 'AAPL': 10},
+    ]
+    # ...with a key of its own for the compensation
+    alice_keys = [key for client_id, key in service.keys if client_id == 'alice']
+    assert len(set(alice_keys)) == 2 and None not in alice_keys
+
+
+def test_failed_fill_can_be_retried(service, tmp_path):
+    engine = SettlementEngine(str(tmp_path))
+    service.failing.add('bob')
+    with pytest.raises(SettlementError):
+        engine.settle([fill('f1', from_client_id='bob')])
+
+    service.failing.clear()
+    assert engine.settle([fill('f1', from_client_id='bob')]) == (1, 0)
+    assert service.portfolios['alice']['AAPL'] == 11
+    assert service.portfolios['bob']['AAPL'] == 1
+
+
+def test_unknown_portfolio_is_not_settled(service, tmp_path):
+    engine = SettlementEngine(str(tmp_path))
+    with pytest.raises(SettlementError) as error:
+        engine.settle([fill('f1', from_client_id='carol')])
+
+    assert error.value.status == 404
+    assert service.puts == []
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import time
+
+import broadcast
+import downstream
+import serialization
+from downstream import AUTH_URL
+from yfinance.cache import TTLCache
+
+try:
+    import jwt
+except ImportError:
+    jwt = None
+
+TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL', '30'))
+TOKEN_CACHE_NEGATIVE_TTL = float(os.getenv('TOKEN_CACHE_NEGATIVE_TTL', '2'))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+
+# Optional local validation of JWTs. When a key is configured, tokens are
+# checked against it instead of calling the Auth Service.
+JWT_KEY_FILE = os.getenv('AUTH_JWT_KEY_FILE')
+JWT_ALGORITHMS = os.getenv('AUTH_JWT_ALGORITHMS', 'HS256').split(',')
+JWT_CLIENT_CLAIM = os.getenv('AUTH_JWT_CLIENT_CLAIM', 'clientID')
+
+# Cached marker for tokens the Auth Service rejected
+_INVALID = {}
+
+_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+# Invalidations reach the caches of every worker process
+_invalidations = broadcast.Channel('tokens')
+_ALL = '*'
+
+_jwt_key = None
+if JWT_KEY_FILE:
+    if jwt is None:
+        raise RuntimeError("AUTH_JWT_KEY_FILE is set but PyJWT is not installed.")
+    with open(JWT_KEY_FILE) as file:
+        _jwt_key = file.read()
+
+
+def _key(authHeader):
+    # Never keep raw tokens in memory longer than needed
+    return hashlib.sha256(authHeader.encode('utf-8')).hexdigest()
+
+def _ttl(result):
+    if result is _INVALID:
+        return TOKEN_CACHE_NEGATIVE_TTL
+    expires_at = result.get('exp')
+    if expires_at is not None:
+        return max(0.0, min(TOKEN_CACHE_TTL, float(expires_at) - time.time()))
+    return TOKEN_CACHE_TTL
+
+def _interpret(response):
+    if response.status_code == 200:
+        return serialization.body(response)
+    if response.status_code in (401, 403):
+        return _INVALID
+    # Anything else says nothing about the token itself, so don't cache it
+    return None
+
+def _verify_remote(authHeader):
+    headers = {'Authorization' : authHeader}
+    response = downstream.post(f"{AUTH_URL}/verify", headers=headers)
+    return _interpret(response)
+
+def _verify_local(authHeader):
+    token = authHeader.split(' ', 1)[1] if ' ' in authHeader else authHeader
+    try:
+        claims = jwt.decode(token, _jwt_key, algorithms=JWT_ALGORITHMS)
+    except jwt.InvalidTokenError:
+        return _INVALID
+    if JWT_CLIENT_CLAIM not in claims:
+        return _INVALID
+    result = {'clientID': claims[JWT_CLIENT_CLAIM]}
+    if 'exp' in claims:
+        result['exp'] = claims['exp']
+    return result
+
+def _sync():
+    for key in _invalidations.poll():
+        _cache.invalidate(None if key == _ALL else key)
+
+def verify_token(authHeader):
+    # Returns the verification result (containing clientID) for the given
+    # Authorization header, or None if the token is not valid
+    _sync()
+    verifier = _verify_local if _jwt_key is not None else _verify_remote
+    result = _cache.load(_key(authHeader), lambda: verifier(authHeader), ttl=_ttl)
+    if result is None or result is _INVALID:
+        return None
+    return dict(result)
+
+async def verify_token_async(authHeader, client):
+    # Same as verify_token, for asyncio callers with an httpx.AsyncClient
+    _sync()
+    key = _key(authHeader)
+    result = _cache.get(key)
+    if result is None:
+        if _jwt_key is not None:
+            result = _verify_local(authHeader)
+        else:
+            headers = {'Authorization' : authHeader}
+            response = await client.post(f"{AUTH_URL}/verify", headers=headers)
+            result = _interpret(response)
+        if result is not None:
+            _cache.put(key, result, ttl=_ttl)
+    if result is None or result is _INVALID:
+        return None
+    return dict(result)
+
+def invalidate(authHeader=None, everywhere=True):
+    # Forget a single token, or every cached verification; in every worker
+    # unless everywhere=False
+    key = _key(authHeader) if authHeader is not None else None
+    _cache.invalidate(key)
+    if everywhere:
+        _invalidations.publish(_ALL if key is None else key)
+
+def stats():
+    return _cache.stats()
@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from yfinance.lazy import lazyImport
+
+np = lazyImport('numpy')
+
+# Prices older than this are re-fetched before a portfolio is valued
+VALUATION_MAX_PRICE_AGE = float(os.getenv('VALUATION_MAX_PRICE_AGE', os.getenv('QUOTE_CACHE_TTL', '5')))
+# Holdings kept for at most this many clients, least recently valued dropped
+VALUATION_CLIENTS = int(os.getenv('VALUATION_CLIENTS', '10000'))
+
+
+class _Holdings(object):
+    def __init__(self, cash, symbols, columns, quantities):
+        self.cash = cash
+        self.symbols = symbols
+        self.columns = columns
+        self.quantities = quantities
+        # Prices the cached total was computed with (NaN = not priced yet)
+        self.prices = np.full(len(symbols), np.nan)
+        self.total = cash
+
+
+class ValuationEngine(object):
+    # Marks portfolios to market from an in-memory price vector. Prices are
+    # pushed in with update_price() as quotes arrive; each client's holdings
+    # are a vector of (column, quantity) pairs, and a client's total is only
+    # adjusted for the prices that moved since it was last valued.
+    def __init__(self, capacity=256, max_age=VALUATION_MAX_PRICE_AGE, max_clients=VALUATION_CLIENTS):
+        self.max_age = max_age
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._columns = {}
+        # Allocated with the first column, so NumPy is only loaded once needed
+        self._capacity = capacity
+        self._prices = None
+        self._as_of = None
+        self._clients = OrderedDict()
+
+    def _column(self, symbol):
+        # Must be called with the lock held
+        column = self._columns.get(symbol)
+        if column is None:
+            column = len(self._columns)
+            if self._prices is None:
+                self._prices = np.full(self._capacity, np.nan)
+                self._as_of = np.zeros(self._capacity)
+            if column == len(self._prices):
+                self._prices = np.concatenate([self._prices, np.full(column, np.nan)])
+                self._as_of = np.concatenate([self._as_of, np.zeros(column)])
+            self._columns[symbol] = column
+        return column
+
+    def update_price(self, symbol, price, as_of=None):
+        with self._lock:
+            column = self._column(symbol)
+            self._prices[column] = np.nan if price is None else float(price)
+            self._as_of[column] = time.time() if as_of is None else as_of
+
+    def set_holdings(self, client_id, portfolio):
+        # Replace a client's positions with those of a portfolio document
+        # ({'Cash': ..., symbol: quantity, ...}), keeping its cached total if
+        # nothing changed
+        cash = float(portfolio['Cash'])
+        positions = [(symbol, int(quantity)) for symbol, quantity in portfolio.items()
+                     if symbol not in ('Cash', 'Value', 'Valuation')]
+        symbols = [symbol for symbol, _ in positions]
+        quantities = np.array([quantity for _, quantity in positions], dtype=np.float64)
+
+        with self._lock:
+            holdings = self._clients.get(client_id)
+            if (holdings is not None and holdings.cash == cash and holdings.symbols == symbols
+                    and np.array_equal(holdings.quantities, quantities)):
+                self._clients.move_to_end(client_id)
+                return
+            columns = np.array([self._column(symbol) for symbol in symbols], dtype=np.intp)
+            self._clients[client_id] = _Holdings(cash, symbols, columns, quantities)
+            self._clients.move_to_end(client_id)
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+
+    def symbols(self, client_id):
+        # Symbols the client holds, as of the last set_holdings
+        with self._lock:
+            holdings = self._clients.get(client_id)
+            return list(holdings.symbols) if holdings is not None else []
+
+    def stale(self, client_id, now=None):
+        # Symbols held by the client with no price, or one older than max_age
+        now = time.time() if now is None else now
+        with self._lock:
+            holdings = self._clients.get(client_id)
+            if holdings is None:
+                return []
+            columns = holdings.columns
+            outdated = np.isnan(self._prices[columns]) | (now - self._as_of[columns] > self.max_age)
+            return [symbol for symbol, flag in zip(holdings.symbols, outdated) if flag]
+
+    def value(self, client_id):
+        # Total value plus a per-symbol breakdown with the as-of time of each
+        # price. Symbols without a price are listed under 'missing' and left
+        # out of the total.
+        with self._lock:
+            holdings = self._clients.get(client_id)
+            if holdings is None:
+                return None
+            prices = self._prices[holdings.columns]
+            as_of = self._as_of[holdings.columns]
+
+            changed = ~((prices == holdings.prices) | (np.isnan(prices) & np.isnan(holdings.prices)))
+            if changed.any():
+                old = np.nan_to_num(holdings.prices[changed])
+                new = np.nan_to_num(prices[changed])
+                holdings.total += float(np.dot(holdings.quantities[changed], new - old))
+                holdings.prices = prices
+            total = holdings.total
+            values = holdings.quantities * prices
+
+        positions = {}
+        missing = []
+        for symbol, quantity, price, value, timestamp in zip(holdings.symbols, holdings.quantities, prices, values, as_of):
+            if np.isnan(price):
+                missing.append(symbol)
+                positions[symbol] = {'quantity': int(quantity), 'price': None, 'value': None, 'asOf': None}
+            else:
+                positions[symbol] = {
+                    'quantity': int(quantity),
+                    'price': float(price),
+                    'value': float(value),
+                    'asOf': datetime.fromtimestamp(timestamp, timezone.utc).isoformat(),
+                }
+        return {
+            'total': total,
+            'cash': holdings.cash,
+            'positions': positions,
+            'missing': missing,
+        }
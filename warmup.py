@@ -0,0 +1,145 @@
+# Gets a freshly started worker ready for traffic: opens pooled connections
+# to the downstream services, fetches the quotes it is likely to be asked
+# for and loads modules that are otherwise imported on first use. Run by
+# gunicorn's post_worker_init hook and the ASGI lifespan before the worker
+# takes requests; GET /ready reports how it went. A worker that couldn't
+# reach one of the services is degraded, and not ready, until that service
+# answers again.
+import logging
+import os
+import threading
+import time
+from concurrent.futures import wait
+
+import downstream
+import yfinance
+from downstream import AUTH_URL, ORDER_MGMT_URL, PORTFOLIO_MGMT_URL
+from yfinance.lazy import getLazyStats, loadModules
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'true').lower() == 'true'
+# Connections opened ahead of time to each service (at most its pool size)
+WARMUP_CONNECTIONS = int(os.getenv('WARMUP_CONNECTIONS', '4'))
+# Comma-separated symbols whose quotes are in the cache before serving
+WARMUP_SYMBOLS = [symbol.strip() for symbol in os.getenv('WARMUP_SYMBOLS', '').split(',') if symbol.strip()]
+# Comma-separated lazily imported modules to load now, or 'all'
+WARMUP_MODULES = os.getenv('WARMUP_MODULES', 'all')
+# Whatever hasn't finished by then is left to the first requests
+WARMUP_TIMEOUT = float(os.getenv('WARMUP_TIMEOUT', '10'))
+# How often, at most, readiness checks retry the services a degraded worker
+# couldn't reach
+WARMUP_RECHECK_INTERVAL = float(os.getenv('WARMUP_RECHECK_INTERVAL', '5'))
+
+SERVICES = {
+    'auth': AUTH_URL,
+    'portfolio-mgmt': PORTFOLIO_MGMT_URL,
+    'order-mgmt': ORDER_MGMT_URL,
+}
+
+IDLE = 'idle'
+WARMING = 'warming'
+READY = 'ready'
+DEGRADED = 'degraded'
+
+_lock = threading.Lock()
+_status = {'state': IDLE}
+_checked_at = 0.0
+
+
+def _connect(url):
+    # Any answer leaves an open connection in the pool
+    response = downstream.request('HEAD', url)
+    return response.status_code
+
+def _outcome(future):
+    if not future.done():
+        return 'timeout'
+    if future.exception() is not None:
+        return type(future.exception()).__name__
+    return 'ok'
+
+def run():
+    # Warm up this process once; later calls return the first one's status
+    with _lock:
+        if _status['state'] != IDLE:
+            return status()
+        _status.update(state=WARMING, pid=os.getpid())
+    if not WARMUP_ENABLED:
+        with _lock:
+            _status.update(state=READY, skipped=True)
+        return status()
+
+    started = time.perf_counter()
+    pool = downstream.executor()
+    connections = {service: [pool.submit(_connect, url) for _ in range(WARMUP_CONNECTIONS)]
+                   for service, url in SERVICES.items()}
+    quotes = pool.submit(yfinance.getQuotesBatch, WARMUP_SYMBOLS, lambda symbol, error: None) if WARMUP_SYMBOLS else None
+
+    # Imports hold the import lock, so they run here while the calls are out
+    modules = loadModules(None if WARMUP_MODULES == 'all' else
+                          {name.strip() for name in WARMUP_MODULES.split(',') if name.strip()})
+
+    futures = [future for futures in connections.values() for future in futures]
+    if quotes is not None:
+        futures.append(quotes)
+    wait(futures, timeout=max(0.0, WARMUP_TIMEOUT - (time.perf_counter() - started)))
+
+    result = {
+        'connections': {service: [_outcome(future) for future in futures] for service, futures in connections.items()},
+        'symbols': {},
+        'modules': modules,
+        'seconds': time.perf_counter() - started,
+    }
+    if quotes is not None:
+        if quotes.done() and quotes.exception() is None:
+            result['symbols'] = {symbol: quote is not None for symbol, quote in quotes.result().items()}
+        else:
+            result['symbols'] = {symbol: False for symbol in WARMUP_SYMBOLS}
+    # Services no connection could be opened to
+    result['unreachable'] = [service for service, outcomes in result['connections'].items() if 'ok' not in outcomes]
+    global _checked_at
+    with _lock:
+        _status.update(result, state=DEGRADED if result['unreachable'] else READY)
+        _checked_at = time.monotonic()
+
+    opened = sum(outcome == 'ok' for outcomes in result['connections'].values() for outcome in outcomes)
+    logger.info("Warmed up in %.3fs: %d/%d connections, %d/%d quotes, %d modules.",
+                result['seconds'], opened, WARMUP_CONNECTIONS * len(SERVICES),
+                sum(result['symbols'].values()), len(WARMUP_SYMBOLS), len(modules))
+    if result['unreachable']:
+        logger.warning("Could not reach %s; degraded until they answer.", ', '.join(result['unreachable']))
+    return status()
+
+def _recheck():
+    # Try the unreachable services again, at most once per interval
+    global _checked_at
+    with _lock:
+        if _status['state'] != DEGRADED or time.monotonic() - _checked_at < WARMUP_RECHECK_INTERVAL:
+            return _status['state']
+        _checked_at = time.monotonic()
+        unreachable = list(_status['unreachable'])
+    still = []
+    for service in unreachable:
+        try:
+            _connect(SERVICES[service])
+        except Exception:
+            still.append(service)
+    with _lock:
+        _status.update(state=DEGRADED if still else READY, unreachable=still)
+        if not still:
+            logger.info("Reached %s again; ready.", ', '.join(unreachable))
+        return _status['state']
+
+def ready():
+    # A process that was never warmed up (e.g. the Flask dev server) serves as it is
+    state = _status['state']
+    if state == DEGRADED:
+        state = _recheck()
+    return state not in (WARMING, DEGRADED)
+
+def status():
+    with _lock:
+        current = dict(_status)
+    current['lazyModules'] = getLazyStats()
+    return current
@@ -1,31 +1,214 @@
 import json
+import os
 import sys
-from lxml import html
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from .cache import TTLCache
+from .extract import EXTRACTORS
+from .history import HistoryStore, parseChart
+from .refresher import QuoteRefresher
+
+# Where quote pages are fetched from, e.g. a local stand-in for benchmarks
+_base_url = os.getenv('YFINANCE_BASE_URL', 'https://finance.yahoo.com').rstrip('/')
+
+# Historical bars come from the chart API, kept under YFINANCE_HISTORY_DIR
+_chart_url = os.getenv('YFINANCE_CHART_URL', 'https://query1.finance.yahoo.com').rstrip('/')
+
+# Quotes are shared by every caller for QUOTE_CACHE_TTL seconds, and kept
+# QUOTE_STALE_MAX_AGE seconds longer for staleQuote
+_cache = TTLCache(maxsize=int(os.getenv('QUOTE_CACHE_SIZE', '1024')),
+                  ttl=float(os.getenv('QUOTE_CACHE_TTL', '5')),
+                  grace=float(os.getenv('QUOTE_STALE_MAX_AGE', '300')))
+
+# Symbols Yahoo! had no quote for, remembered QUOTE_NEGATIVE_TTL seconds so
+# repeated requests for them don't each reach Yahoo!
+_unknown = TTLCache(maxsize=int(os.getenv('QUOTE_CACHE_SIZE', '1024')),
+                    ttl=float(os.getenv('QUOTE_NEGATIVE_TTL', '30')))
+
+# HTTP client used for Yahoo! requests; anything exposing a requests-style
+# get(), e.g. a pooled session wrapper
+_client = requests
+
+# Turns a quote page into a quote dict; YFINANCE_EXTRACTOR picks one of
+# EXTRACTORS, or install your own with setExtractor
+_extractor = EXTRACTORS[os.getenv('YFINANCE_EXTRACTOR', 'streaming')]
+
+# Called with the seconds spent in each parse, e.g. to record metrics
+_parseObserver = None
+
+# Bounded pool used by getQuotesBatch, created on first use
+_batch_workers = int(os.getenv('QUOTE_BATCH_WORKERS', '16'))
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
 
 def buildUrl(symbol):
     # Get Yahoo! Finance URL for symbol
-    return f'https://finance.yahoo.com/quote/{symbol}/'
+    return f'{_base_url}/quote/{symbol}/'
 
 def request(symbol):
     url = buildUrl(symbol)
-    page = requests.get(url)
-    tree = html.fromstring(page.content)
-
-    # Get element using XPath
-    price = tree.xpath("/html/body/div[1]/div/div/div[1]/div/div[2]/div/div/div[6]/div/div/div/div[3]/div[1]/div[1]/fin-streamer[1]")
-    content = {}
-    try:
-        content['price'] = float(price[0].text)
-    except:
-        return None
+    page = _client.get(url)
+    return parse(page.content, symbol)
 
+def parse(content, symbol=None):
+    started = time.perf_counter()
+    content = _extractor(content, symbol)
+    if _parseObserver is not None:
+        _parseObserver(time.perf_counter() - started)
     return content
 
-def getQuotes(symbol):
+# Functions called with (symbol, quote) whenever a new quote is fetched
+_listeners = []
+
+def addQuoteListener(listener):
+    _listeners.append(listener)
+
+def _notify(symbol, content):
+    if content is not None:
+        for listener in _listeners:
+            listener(symbol, content)
+
+def _fetch(symbol):
     content = request(symbol)
+    _notify(symbol, content)
     return content
 
+def refreshQuote(symbol):
+    # Fetch symbol again and replace whatever is cached for it
+    content = _fetch(symbol)
+    if content is not None:
+        _cache.put(symbol, content)
+        _unknown.invalidate(symbol)
+    return content
+
+# Re-fetches the QUOTE_REFRESH_TOP most requested symbols every
+# QUOTE_REFRESH_INTERVAL seconds, ahead of their cache expiry (0 disables)
+_refresher = QuoteRefresher(refreshQuote,
+                            top=int(os.getenv('QUOTE_REFRESH_TOP', '100')),
+                            interval=float(os.getenv('QUOTE_REFRESH_INTERVAL', '2')),
+                            workers=int(os.getenv('QUOTE_REFRESH_WORKERS', '8')))
+
+def trackQuote(symbol):
+    # Record a request for symbol so the refresher keeps it warm; only for
+    # symbols known to have a quote
+    _refresher.track(symbol)
+
+def isUnknown(symbol):
+    # Whether Yahoo! recently had no quote for symbol
+    return _unknown.peek(symbol) is not None
+
+def getQuotes(symbol):
+    if isUnknown(symbol):
+        return None
+    content = _cache.load(symbol, lambda: _fetch(symbol))
+    if content is None:
+        _unknown.put(symbol, True)
+        return None
+    trackQuote(symbol)
+    # Callers decorate the quote (e.g. with depth), so hand out a copy
+    return dict(content)
+
+def setClient(client):
+    global _client
+    _client = client
+
+def setExtractor(extractor):
+    # extractor(content, symbol) returns a quote dict or None
+    global _extractor
+    _extractor = extractor
+
+def setParseObserver(observer):
+    global _parseObserver
+    _parseObserver = observer
+
+def _getExecutor():
+    # Recreated in forked workers, whose copy has no threads
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=_batch_workers, thread_name_prefix='quotes')
+            _executor_pid = os.getpid()
+        return _executor
+
+def getQuotesBatch(symbols, fallback=None):
+    # Fetch quotes for several symbols concurrently. Returns a dict mapping
+    # each distinct symbol to its quote, or None if it could not be found.
+    # If a fetch fails, fallback(symbol, error) supplies the quote instead
+    # when given; otherwise the error is raised.
+    symbols = list(dict.fromkeys(symbols))
+    fetch = getQuotes
+    if fallback is not None:
+        def fetch(symbol):
+            try:
+                return getQuotes(symbol)
+            except Exception as e:
+                return fallback(symbol, e)
+    if len(symbols) <= 1:
+        return {symbol: fetch(symbol) for symbol in symbols}
+
+    executor = _getExecutor()
+    futures = {symbol: executor.submit(fetch, symbol) for symbol in symbols}
+    return {symbol: future.result() for symbol, future in futures.items()}
+
+def cachedQuote(symbol):
+    # Quote for symbol if it is cached and fresh, without fetching it
+    content = _cache.get(symbol)
+    if content is None:
+        return None
+    return dict(content)
+
+def staleQuote(symbol):
+    # Last quote fetched for symbol, even if expired, for when Yahoo! cannot
+    # be reached
+    content = _cache.stale(symbol)
+    if content is None:
+        return None
+    return dict(content)
+
+def storeQuote(symbol, content):
+    # Cache a quote that was fetched outside of getQuotes; None records that
+    # Yahoo! had none
+    if content is None:
+        _unknown.put(symbol, True)
+        return
+    _cache.put(symbol, content)
+    _unknown.invalidate(symbol)
+    _notify(symbol, content)
+
+def getQuoteCacheStats():
+    return _cache.stats()
+
+def getRefresherStats():
+    return _refresher.stats()
+
+def clearQuoteCache(symbol=None):
+    _cache.invalidate(symbol)
+    _unknown.invalidate(symbol)
+
+def _fetchChart(symbol, start, end, interval):
+    # Bars in [start, end) as columns, or None if Yahoo! has none to give
+    page = _client.get(f'{_chart_url}/v8/finance/chart/{symbol}',
+                       params={'period1': start, 'period2': end, 'interval': interval})
+    if page.status_code != 200:
+        return None
+    return parseChart(page.json())
+
+_history = HistoryStore(os.getenv('YFINANCE_HISTORY_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'yfinance', 'history')),
+                        _fetchChart)
+
+def getHistory(symbol, start, end=None, interval='1d'):
+    # OHLCV bars of symbol from start up to end (datetimes or epoch seconds;
+    # end defaults to now) as {column: array}. Ranges fetched before are
+    # read from disk; only what is missing, and the latest bars, which may
+    # still be in progress, are requested.
+    return _history.get(symbol, start, end, interval)
+
+def getHistoryStats():
+    return _history.stats()
+
 if __name__ == '__main__':
     try:
         symbol = sys.argv[1]
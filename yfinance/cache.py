@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight(object):
+    # A fetch in progress; concurrent misses for the same key wait on it
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache(object):
+    def __init__(self, maxsize=1024, ttl=5.0, clock=time.monotonic, grace=0.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Expired entries are kept this much longer for stale() only
+        self.grace = grace
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (value, expires_at), least recently used first
+        self._entries = OrderedDict()
+        self._flights = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+
+    def _lookup(self, key):
+        # Must be called with the lock held
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        now = self._clock()
+        if expires_at <= now:
+            if expires_at + self.grace <= now:
+                del self._entries[key]
+                self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, value, ttl):
+        # Must be called with the lock held. ttl may be a number of seconds
+        # or a function computing it from the value.
+        if ttl is None:
+            ttl = self.ttl
+        elif callable(ttl):
+            ttl = ttl(value)
+        self._entries[key] = (value, self._clock() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key):
+        # Like get, but without counting towards the statistics or the LRU order
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= self._clock():
+                return None
+            return entry[0]
+
+    def stale(self, key):
+        # The value for key even if it expired less than grace seconds ago,
+        # for use when it cannot be fetched again; doesn't touch the statistics
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] + self.grace <= self._clock():
+                return None
+            return entry[0]
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def load(self, key, loader, ttl=None):
+        # Return the cached value for key, calling loader() on a miss.
+        # Only one loader runs per key at a time; other callers missing on
+        # the same key wait for its result instead of fetching themselves.
+        # None results are handed to the waiting callers but not cached.
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if flight.error is None and flight.value is not None:
+                    self._store(key, flight.value, ttl)
+                del self._flights[key]
+            flight.event.set()
+        return flight.value
+
+    def invalidate(self, key=None):
+        # Drop a single key, or everything when no key is given
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRatio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'coalesced': self.coalesced,
+                'inflight': len(self._flights),
+            }
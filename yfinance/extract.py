@@ -0,0 +1,109 @@
+from .lazy import lazyImport
+
+# Only needed once the first quote page is parsed
+etree = lazyImport('lxml.etree')
+html = lazyImport('lxml.html')
+
+# Absolute location of the price element in the Yahoo! Finance quote page
+PRICE_XPATH = "/html/body/div[1]/div/div/div[1]/div/div[2]/div/div/div[6]/div/div/div/div[3]/div[1]/div[1]/fin-streamer[1]"
+
+# fin-streamer data-field -> quote key, and how to convert its value
+FIELDS = {
+    'regularMarketPrice': ('price', float),
+    'regularMarketChange': ('change', float),
+    'regularMarketChangePercent': ('changePercent', float),
+    'regularMarketVolume': ('volume', int),
+    'bid': ('bid', float),
+    'ask': ('ask', float),
+    'marketState': ('marketState', str),
+}
+
+# Bid and ask are also rendered as "<price> x <size>" table cells
+CELLS = {
+    'BID-value': 'bid',
+    'ASK-value': 'ask',
+}
+
+# Once the price is known, give up on the remaining fields after this many
+# further candidate elements without finding one
+LOOKAHEAD = 200
+
+CHUNK_SIZE = 16384
+
+
+def _number(text, convert):
+    text = text.strip().strip('()%+').replace(',', '')
+    return convert(text)
+
+def extractXPath(content, symbol=None):
+    # Builds the whole document tree and walks the absolute XPath to the price
+    tree = html.fromstring(content)
+    price = tree.xpath(PRICE_XPATH)
+    try:
+        return {'price': float(price[0].text)}
+    except:
+        return None
+
+def _chunks(content):
+    for start in range(0, len(content), CHUNK_SIZE):
+        yield content[start:start + CHUNK_SIZE]
+
+def _elements(content):
+    parser = etree.HTMLPullParser(events=('end',), tag=('fin-streamer', 'td'))
+    for chunk in _chunks(content):
+        parser.feed(chunk)
+        for _, element in parser.read_events():
+            yield element
+    try:
+        parser.close()
+    except etree.XMLSyntaxError:
+        return
+    for _, element in parser.read_events():
+        yield element
+
+def extractStreaming(content, symbol=None):
+    # Feeds the page to an incremental parser and stops as soon as the price
+    # and the other quote fields have been seen. Elements are matched on their
+    # data-symbol/data-field attributes rather than their position.
+    content_symbol = symbol.upper() if symbol is not None else None
+    quote = {}
+    since_last = 0
+
+    for element in _elements(content):
+        key = None
+        value = None
+        field = element.get('data-field')
+        if element.tag == 'fin-streamer' and field in FIELDS:
+            element_symbol = element.get('data-symbol')
+            if content_symbol is None or element_symbol is None or element_symbol.upper() == content_symbol:
+                key, convert = FIELDS[field]
+                raw = element.get('value') or element.text or ''
+                try:
+                    value = raw if convert is str else _number(raw, convert)
+                except ValueError:
+                    key = None
+        elif element.tag == 'td' and element.get('data-test') in CELLS:
+            key = CELLS[element.get('data-test')]
+            try:
+                value = _number((element.text or '').split('x')[0], float)
+            except ValueError:
+                key = None
+
+        if key is not None and key not in quote:
+            quote[key] = value
+            since_last = 0
+        else:
+            since_last += 1
+        element.clear()
+
+        if 'price' in quote and (len(quote) == len(FIELDS) or since_last >= LOOKAHEAD):
+            return quote
+
+    if 'price' not in quote:
+        return None
+    return quote
+
+EXTRACTORS = {
+    'streaming': extractStreaming,
+    'xpath': extractXPath,
+}
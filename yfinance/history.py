@@ -0,0 +1,257 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from urllib.parse import quote
+
+from .lazy import lazyImport
+
+np = lazyImport('numpy')
+
+# Seconds per bar for each interval Yahoo! Finance serves
+INTERVALS = {
+    '1m': 60, '2m': 120, '5m': 300, '15m': 900, '30m': 1800, '60m': 3600, '90m': 5400,
+    '1h': 3600, '1d': 86400, '5d': 432000, '1wk': 604800, '1mo': 2592000,
+}
+
+# Longest a bar of each interval can last, where that isn't the nominal
+# length: five trading days may span a weekend, a month 31 days
+LONGEST = dict(INTERVALS, **{'5d': 7 * 86400, '1mo': 31 * 86400})
+
+# Longest range a single chart request may cover; longer gaps are split
+MAX_SPAN = {
+    '1m': 7 * 86400, '2m': 60 * 86400, '5m': 60 * 86400, '15m': 60 * 86400, '30m': 60 * 86400,
+    '60m': 730 * 86400, '90m': 60 * 86400, '1h': 730 * 86400,
+}
+
+# One file per column, so a range is a slice of each memory-mapped column
+COLUMNS = (
+    ('time', 'int64'),
+    ('open', 'float64'),
+    ('high', 'float64'),
+    ('low', 'float64'),
+    ('close', 'float64'),
+    ('volume', 'int64'),
+)
+
+
+def _timestamp(value):
+    # Epoch seconds from a number or a datetime
+    if hasattr(value, 'timestamp'):
+        return int(value.timestamp())
+    return int(value)
+
+def _addRange(ranges, start, end):
+    # Insert [start, end) into sorted, disjoint ranges, merging neighbours
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+def _missingRanges(ranges, start, end):
+    missing = []
+    for range_start, range_end in ranges:
+        if range_end <= start:
+            continue
+        if range_start >= end:
+            break
+        if range_start > start:
+            missing.append((start, range_start))
+        start = max(start, range_end)
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+def _split(start, end, span):
+    while start < end:
+        yield start, min(end, start + span)
+        start += span
+
+def parseChart(document):
+    # Columns of a Yahoo! Finance chart API response, bars without a close
+    # (no trades) left out
+    result = (document.get('chart') or {}).get('result') or []
+    if not result or not result[0].get('timestamp'):
+        return {name: np.empty(0, dtype) for name, dtype in COLUMNS}
+    result = result[0]
+    bars = result['indicators']['quote'][0]
+    columns = {'time': np.asarray(result['timestamp'], dtype=np.int64)}
+    for name, dtype in COLUMNS[1:]:
+        values = np.array([np.nan if value is None else value for value in bars.get(name, [])], dtype=np.float64)
+        columns[name] = values
+    keep = ~np.isnan(columns['close'])
+    columns['volume'] = np.nan_to_num(columns['volume'])
+    return {name: columns[name][keep].astype(dtype) for name, dtype in COLUMNS}
+
+
+class _Series(object):
+    # Bars of one symbol and interval, as read from disk
+    def __init__(self, stamp, meta, columns):
+        self.stamp = stamp
+        self.meta = meta
+        self.columns = columns
+
+
+class HistoryStore(object):
+    # Stores bars in <directory>/<symbol>/<interval>/ as one raw file per
+    # column plus meta.json, which records the row count, the generation of
+    # the column files and the time ranges already fetched. Bars arriving
+    # after the last stored one are appended; anything else rewrites the
+    # columns as a new generation. Readers only go by meta.json, which is
+    # replaced atomically, so they never see a partial write.
+    def __init__(self, directory, fetch):
+        self.directory = directory
+        self._fetch = fetch
+        self._lock = threading.Lock()
+        self._locks = {}
+        self._series = {}
+
+        self.fetches = 0
+        self.bars = 0
+
+    def _path(self, symbol, interval, name=''):
+        return os.path.join(self.directory, quote(symbol.upper(), safe=''), interval, name)
+
+    def _keyLock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _read(self, symbol, interval):
+        key = (symbol.upper(), interval)
+        path = self._path(symbol, interval, 'meta.json')
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return _Series(None, {'count': 0, 'generation': 0, 'ranges': []},
+                           {name: np.empty(0, dtype) for name, dtype in COLUMNS})
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        series = self._series.get(key)
+        if series is not None and series.stamp == stamp:
+            return series
+
+        with open(path) as file:
+            meta = json.load(file)
+        count = meta['count']
+        columns = {}
+        for name, dtype in COLUMNS:
+            if count:
+                columns[name] = np.memmap(self._path(symbol, interval, f"{name}.{meta['generation']}"),
+                                          dtype=dtype, mode='r', shape=(count,))
+            else:
+                columns[name] = np.empty(0, dtype)
+        series = self._series[key] = _Series(stamp, meta, columns)
+        return series
+
+    def _writeMeta(self, symbol, interval, meta):
+        path = self._path(symbol, interval, 'meta.json')
+        with open(path + '.tmp', 'w') as file:
+            json.dump(meta, file)
+        os.replace(path + '.tmp', path)
+
+    def _store(self, symbol, interval, bars, ranges):
+        # Add bars fetched for the given (start, end) ranges; must hold the
+        # key's locks
+        series = self._read(symbol, interval)
+        meta = dict(series.meta)
+        stored = series.columns
+        new = np.isin(bars['time'], stored['time'], invert=True)
+        bars = {name: column[new] for name, column in bars.items()}
+        order = np.argsort(bars['time'], kind='stable')
+        bars = {name: column[order] for name, column in bars.items()}
+        added = len(bars['time'])
+
+        old = None
+        if added and meta['count'] and bars['time'][0] <= stored['time'][-1]:
+            # Out of order: write the merged columns as a new generation
+            merged = {name: np.concatenate([stored[name], bars[name]]) for name, _ in COLUMNS}
+            order = np.argsort(merged['time'], kind='stable')
+            old = meta['generation']
+            meta['generation'] = old + 1
+            for name, dtype in COLUMNS:
+                merged[name][order].astype(dtype).tofile(self._path(symbol, interval, f"{name}.{meta['generation']}"))
+        elif added:
+            for name, dtype in COLUMNS:
+                path = self._path(symbol, interval, f"{name}.{meta['generation']}")
+                with open(path, 'ab') as file:
+                    # Drop anything an interrupted append left past the count
+                    file.truncate(meta['count'] * np.dtype(dtype).itemsize)
+                    file.write(bars[name].astype(dtype).tobytes())
+
+        meta['count'] += added
+        meta['ranges'] = [list(r) for r in meta['ranges']]
+        for start, end in ranges:
+            meta['ranges'] = _addRange(meta['ranges'], start, end)
+        self._writeMeta(symbol, interval, meta)
+        if old is not None:
+            for name, _ in COLUMNS:
+                os.remove(self._path(symbol, interval, f'{name}.{old}'))
+        self.bars += added
+
+    def _fill(self, symbol, interval, start, end):
+        # Fetch whatever part of [start, end) has not been fetched yet
+        if start >= end:
+            return
+
+        key = (symbol.upper(), interval)
+        os.makedirs(self._path(symbol, interval), exist_ok=True)
+        with self._keyLock(key), open(self._path(symbol, interval, '.lock'), 'w') as lock:
+            # Other processes share the directory
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            fetched = []
+            ranges = []
+            chunks = [chunk for gap_start, gap_end in _missingRanges(self._read(symbol, interval).meta['ranges'], start, end)
+                      for chunk in _split(gap_start, gap_end, MAX_SPAN.get(interval, gap_end - gap_start))]
+            for chunk_start, chunk_end in chunks:
+                bars = self._fetch(symbol, chunk_start, chunk_end, interval)
+                self.fetches += 1
+                if bars is None:
+                    break
+                keep = (bars['time'] >= chunk_start) & (bars['time'] < chunk_end)
+                fetched.append({name: column[keep] for name, column in bars.items()})
+                ranges.append((chunk_start, chunk_end))
+            # Everything fetched is written at once, so filling several gaps
+            # rewrites the columns at most once
+            if ranges:
+                bars = {name: np.concatenate([part[name] for part in fetched]) for name, _ in COLUMNS}
+                self._store(symbol, interval, bars, ranges)
+
+    def get(self, symbol, start, end=None, interval='1d'):
+        # Bars with start <= time < end as {column: array}. The arrays are
+        # read-only views of the memory-mapped files.
+        if interval not in INTERVALS:
+            raise ValueError(f"Unsupported interval {interval!r}")
+        start = _timestamp(start)
+        end = int(time.time()) if end is None else _timestamp(end)
+        # Bars aren't aligned to the epoch (US hourly bars start at :30, weeks
+        # on Mondays), so only bars that started at least their longest
+        # length ago are known to be complete and stored. The tail after
+        # that is fetched on every call and never stored.
+        cutoff = max(start, min(end, int(time.time()) - LONGEST[interval]))
+        self._fill(symbol, interval, start, cutoff)
+
+        columns = self._read(symbol, interval).columns
+        first, last = np.searchsorted(columns['time'], [start, cutoff])
+        bars = {name: column[first:last] for name, column in columns.items()}
+        tail = self._tail(symbol, interval, cutoff, end)
+        if tail is not None and len(tail['time']):
+            bars = {name: np.concatenate([bars[name], tail[name].astype(dtype)]) for name, dtype in COLUMNS}
+        return bars
+
+    def _tail(self, symbol, interval, start, end):
+        # Bars in [start, end) straight from the fetcher, sorted, or None
+        if start >= end:
+            return None
+        bars = self._fetch(symbol, start, end, interval)
+        self.fetches += 1
+        if bars is None:
+            return None
+        keep = (bars['time'] >= start) & (bars['time'] < end)
+        order = np.argsort(bars['time'][keep], kind='stable')
+        return {name: column[keep][order] for name, column in bars.items()}
+
+    def stats(self):
+        return {'series': len(self._series), 'fetches': self.fetches, 'bars': self.bars}
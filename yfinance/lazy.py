@@ -0,0 +1,67 @@
+import importlib
+import importlib.util
+import os
+import time
+
+# LAZY_IMPORTS=false imports every module up front instead, e.g. to fail
+# fast on a missing dependency
+_enabled = os.getenv('LAZY_IMPORTS', 'true').lower() == 'true'
+
+# Every module handed out by lazyImport, by name
+_modules = {}
+
+
+class LazyModule(object):
+    # Stands in for a module until one of its attributes is first used. The
+    # module is imported then, and its namespace copied in so that later
+    # lookups are plain attribute reads.
+    def __init__(self, name):
+        self.__dict__['_lazyName'] = name
+        self.__dict__['_lazyModule'] = None
+
+    def __getattr__(self, attribute):
+        return getattr(_load(self), attribute)
+
+    def __repr__(self):
+        return f"<lazy module '{self.__dict__['_lazyName']}'>"
+
+
+def _load(lazy):
+    module = lazy.__dict__['_lazyModule']
+    if module is None:
+        module = importlib.import_module(lazy.__dict__['_lazyName'])
+        lazy.__dict__.update(module.__dict__)
+        lazy.__dict__['_lazyModule'] = module
+    return module
+
+def lazyImport(name, optional=False):
+    # Module name, imported on first use. Optional modules that are not
+    # installed come back as None, like a failed `import` would leave them.
+    if optional and importlib.util.find_spec(name.partition('.')[0]) is None:
+        return None
+    if name in _modules:
+        return _modules[name]
+    if not _enabled:
+        module = importlib.import_module(name)
+    else:
+        module = LazyModule(name)
+    _modules[name] = module
+    return module
+
+def isLoaded(module):
+    return not isinstance(module, LazyModule) or module.__dict__['_lazyModule'] is not None
+
+def loadModules(names=None):
+    # Import the given lazy modules (all of them by default) now, e.g. while
+    # a worker warms up. Returns the seconds spent on each.
+    timings = {}
+    for name, module in list(_modules.items()):
+        if names is not None and name not in names or isLoaded(module):
+            continue
+        started = time.perf_counter()
+        _load(module)
+        timings[name] = time.perf_counter() - started
+    return timings
+
+def getLazyStats():
+    return {name: isLoaded(module) for name, module in _modules.items()}
@@ -0,0 +1,101 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+class QuoteRefresher(object):
+    # Keeps the most requested symbols warm by re-fetching them in the
+    # background every interval seconds. Popularity is a decaying request
+    # count, so symbols that stop being requested fall out of the top N and
+    # are forgotten after idle_rounds rounds without requests.
+    def __init__(self, refresh, top=100, interval=2.0, workers=8, idle_rounds=5, decay=0.5):
+        self._refresh = refresh
+        self.top = top
+        self.interval = interval
+        self.workers = workers
+        self.idle_rounds = idle_rounds
+        self.decay = decay
+
+        self._lock = threading.Lock()
+        self._hits = {}
+        self._scores = {}
+        self._idle = {}
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+        self.rounds = 0
+        self.refreshed = 0
+        self.failures = 0
+
+    def track(self, symbol):
+        if self.top <= 0:
+            return
+        with self._lock:
+            self._hits[symbol] = self._hits.get(symbol, 0) + 1
+        self._ensureStarted()
+
+    def _ensureStarted(self):
+        # Started on first use, and again in a forked child where the
+        # parent's thread doesn't exist
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._stop = threading.Event()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='quote-refresher', daemon=True)
+            self._thread.start()
+
+    def hot(self):
+        # Symbols to refresh this round, hottest first
+        with self._lock:
+            hits, self._hits = self._hits, {}
+            for symbol in set(self._scores) | set(hits):
+                count = hits.get(symbol, 0)
+                self._scores[symbol] = self._scores.get(symbol, 0.0) * self.decay + count
+                self._idle[symbol] = 0 if count else self._idle.get(symbol, 0) + 1
+                if self._idle[symbol] > self.idle_rounds:
+                    del self._scores[symbol]
+                    del self._idle[symbol]
+            ranked = sorted(self._scores, key=self._scores.get, reverse=True)
+            return ranked[:self.top]
+
+    def refreshOnce(self, executor):
+        symbols = self.hot()
+        futures = [executor.submit(self._refresh, symbol) for symbol in symbols]
+        wait(futures)
+        for future in futures:
+            if future.exception() is not None:
+                self.failures += 1
+            else:
+                self.refreshed += 1
+        self.rounds += 1
+
+    def _run(self):
+        stop = self._stop
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='quote-refresh') as executor:
+            while not stop.wait(self.interval):
+                try:
+                    self.refreshOnce(executor)
+                except Exception:
+                    logger.exception("Quote refresh round failed.")
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tracked': len(self._scores) + len(set(self._hits) - set(self._scores)),
+                'top': self.top,
+                'interval': self.interval,
+                'rounds': self.rounds,
+                'refreshed': self.refreshed,
+                'failures': self.failures,
+            }